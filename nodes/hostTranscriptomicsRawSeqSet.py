@@ -10,6 +10,7 @@ import settings
 from cutlass_utils import \
         load_data, get_parent_node_id, list_tags, format_query, \
         write_csv_headers, values_to_node_dict, write_out_csv, \
+        write_tracking_rows, run_submissions, \
         load_node, get_field_header, dump_args, log_it
 
 filename = os.path.basename(__file__)
@@ -97,12 +98,12 @@ def validate_record(parent_id, node, record, data_file_name=node_type):
                       fieldnames=csv_fieldnames, values=[record,])
         return False
 
-def submit(data_file, id_tracking_file=node_tracking_file):
+def submit(data_file, id_tracking_file=node_tracking_file, workers=None):
     log.info('Starting submission of %ss.', node_type)
-    nodes = []
     csv_fieldnames = get_field_header(data_file)
     write_csv_headers(data_file,fieldnames=csv_fieldnames)
-    for record in load_data(data_file):
+
+    def submit_record(record):
         log.info('...next record...')
         try:
             log.debug('data record: '+str(record))
@@ -134,18 +135,21 @@ def submit(data_file, id_tracking_file=node_tracking_file):
                           parent_type.lower(),parent_internal_id,parent_id]],
                         header
                         )
-                    nodes.append(vals)
                     if node_is_new:
-                        write_out_csv(id_tracking_file,
-                              fieldnames=get_field_header(id_tracking_file),
-                              values=vals)
+                        write_tracking_rows(id_tracking_file, vals)
+                return saved and vals
             else:
                 log.error('No parent_id found for %s', parent_internal_id)
 
         except Exception, e:
             log.exception(e)
             raise e
-    return nodes
+
+    results = run_submissions(submit_record, load_data(data_file), workers,
+                              data_file=data_file,
+                              key=lambda record: os.path.basename(record['local_file']),
+                              lookup=('local_file', 'HostTranscriptomicsRawSeqSet'))
+    return [vals for vals in results if vals]
 
 
 if __name__ == '__main__':
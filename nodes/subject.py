@@ -11,6 +11,7 @@ from cutlass_utils import \
         load_data, get_parent_node_id, \
         list_tags, format_query, \
         values_to_node_dict, write_out_csv, \
+        write_tracking_rows, run_submissions, \
         log_it, dump_args, \
         get_cur_datetime
 
@@ -118,10 +119,10 @@ def validate_record(parent_id, node, record):
 
 
 def submit(parent_name, parent_id, data_file,
-        id_tracking_file=node_tracking_file):
+        id_tracking_file=node_tracking_file, workers=None):
     log.info('Starting submission of subjects.')
-    nodes = []
-    for record in load_data(data_file):
+
+    def submit_record(record):
         try:
             log.debug('...trying next record...')
             # log.debug(record)
@@ -136,13 +137,16 @@ def submit(parent_name, parent_id, data_file,
                               parent_type,parent_name,parent_id,
                               get_cur_datetime()]]
                             )
-                    write_out_csv(id_tracking_file,
-                            values=vals)
-                    nodes.append(vals)
+                    write_tracking_rows(id_tracking_file, vals)
+                return saved and vals
         except Exception, e:
             log.error(e)
             raise e
-    return nodes
+
+    results = run_submissions(submit_record, load_data(data_file), workers,
+                              data_file=data_file,
+                              key=lambda record: record['rand_subject_id'])
+    return [vals for vals in results if vals]
 
 
 if __name__ == '__main__':
@@ -9,6 +9,8 @@ import logging
 import time
 import shutil
 
+from archive_utils import prefix_tar
+
 """Subprocess module wrappers"""
 from subprocess import call, check_output
 from subprocess import STDOUT
@@ -63,14 +65,11 @@ def get_output(cmd_string, stderr=STDOUT, shell=True,
 
 
 def generate_raw_tar(dest_path="./", file_prefix=""):
-    """generate tar archives, return file name"""
+    """generate tar archive of files named file_prefix*, return file name"""
     try:
-        src_path = os.path.dirname(file_prefix)
-        prefix = os.path.basename(file_prefix)
-        os.chdir(src_path)
-        tar_file = os.path.join(dest_path, file_prefix + '.raw.fastq.tar')
-        tar_cmd = ' '.join(['tar', 'chf', tar_file, prefix+'*'])
-        tar_stat = get_output(tar_cmd)
+        tar_file = os.path.join(dest_path,
+                                os.path.basename(file_prefix) + '.raw.fastq.tar')
+        prefix_tar(tar_file, file_prefix)
 
         log.info('Archive file created: %s', tar_file)
         return tar_file
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""In-process tar archiving for the file renaming scripts
+   (dcc_submission_file_name_change.py, etc), replacing `cd dir; tar chf`.
+
+   Archives are built from an explicit list of member files, without
+   changing the working directory, so many can be built at once on a pool of
+   worker threads.
+"""
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Imports ~~~~~
+import os
+import fnmatch
+import logging
+import tarfile
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Constants ~~~~~
+log = logging.getLogger(os.path.basename(__file__))
+
+# never archived: finished and in-progress archives (a shorter prefix, e.g.
+# 'S1', also globs those of a longer one, 'S10', maybe being built at once)
+EXCLUDE_PATTERNS = ('*.raw.fastq.tar', '*.part')
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Functional ~~~~~
+
+def prefix_members(file_prefix, exclude=()):
+    """sorted paths of files named file_prefix* (as the shell glob would;
+       file_prefix may hold wildcards, e.g. 'sample.*'), less any in exclude
+       or matching EXCLUDE_PATTERNS
+    """
+    src_path = os.path.dirname(file_prefix) or os.curdir
+    pattern = os.path.basename(file_prefix) + '*'
+    exclude = set(os.path.abspath(f) for f in exclude)
+    return [os.path.join(src_path, name)
+            for name in sorted(os.listdir(src_path))
+            if fnmatch.fnmatch(name, pattern) and
+               not any(fnmatch.fnmatch(name, excluded)
+                       for excluded in EXCLUDE_PATTERNS) and
+               os.path.abspath(os.path.join(src_path, name)) not in exclude]
+
+
+def write_tar(tar_file, members):
+    """write tar_file of members, each stored under its base name and
+       dereferenced if a symlink (as `tar chf`); return tar_file.
+       Written to 'tar_file.part' first, so a failed run leaves no archive.
+    """
+    if not members:
+        raise IOError('No files to archive in {}'.format(tar_file))
+    part_file = tar_file + '.part'
+    try:
+        tar = tarfile.open(part_file, 'w', dereference=True,
+                           format=tarfile.GNU_FORMAT)
+        try:
+            for member in members:
+                tar.add(member, arcname=os.path.basename(member))
+        finally:
+            tar.close()
+        os.rename(part_file, tar_file)
+    except:
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        raise
+    return tar_file
+
+
+def prefix_tar(tar_file, file_prefix):
+    """write tar_file of all files named file_prefix*; return tar_file"""
+    members = prefix_members(file_prefix,
+                             exclude=[tar_file, tar_file + '.part'])
+    log.debug('Archiving %s files into %s', len(members), tar_file)
+    return write_tar(tar_file, members)
+
+
+def run_pooled(func, items, workers=None):
+    """yield (item, func(item), None) for each of items, in order of
+       completion, running `workers` at once (default: one per cpu);
+       if func raised, yield (item, None, exception) instead.
+    """
+    def call(item):
+        try:
+            return (item, func(item), None)
+        except Exception, e:
+            return (item, None, e)
+
+    items = list(items)
+    if not items:
+        return
+    pool = ThreadPool(min(workers or cpu_count(), len(items)))
+    try:
+        for result in pool.imap_unordered(call, items):
+            yield result
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""In-process md5 and sha256 file checksums, shared by the file renaming and
+   checksum scripts (dcc_submission_file_name_change.py, etc).
+
+   Each file is read once, in large blocks, feeding both digests; many files
+   are checksummed at once across a pool of processes.
+   Digests can be kept in a ChecksumCache, so that unchanged files are not
+   read again on the next run.
+"""
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Imports ~~~~~
+import os
+import hashlib
+import logging
+import sqlite3
+from multiprocessing import Pool, cpu_count
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Constants ~~~~~
+BLOCK_SIZE = 8 * 1024 * 1024  # bytes per read
+
+log = logging.getLogger(os.path.basename(__file__))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Functional ~~~~~
+
+def file_checksums(filename, block_size=BLOCK_SIZE):
+    """md5 and sha256 of filename in a single read; return two hex digests"""
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as fh:
+        block = fh.read(block_size)
+        while block:
+            md5.update(block)
+            sha256.update(block)
+            block = fh.read(block_size)
+    return (md5.hexdigest(), sha256.hexdigest())
+
+
+class ChecksumCache(object):
+    """Persistent (md5, sha256) of files, in an sqlite db.
+       Entries are keyed by device, inode, size and mtime (ns), so a file
+       that is modified, replaced or renamed-over misses the cache.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file)
+        self.conn.text_factory = str
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS checksums ('
+            ' dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER,'
+            ' path TEXT, md5 TEXT, sha256 TEXT,'
+            ' PRIMARY KEY (dev, ino, size, mtime_ns))')
+        self.conn.commit()
+        self.pending = 0
+
+    @classmethod
+    def for_checksum_list(cls, checksum_file):
+        """cache kept alongside checksum_file (the csv of checksums)"""
+        return cls(checksum_file + '.cache.db')
+
+    @staticmethod
+    def file_key(filename):
+        st = os.stat(filename)
+        mtime_ns = getattr(st, 'st_mtime_ns', int(st.st_mtime * 1e9))
+        return (st.st_dev, st.st_ino, st.st_size, mtime_ns)
+
+    def get(self, filename, key=None):
+        """cached (md5, sha256) of filename if unchanged, else None"""
+        row = self.conn.execute(
+            'SELECT md5, sha256 FROM checksums'
+            ' WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?',
+            key or self.file_key(filename)).fetchone()
+        return tuple(row) if row else None
+
+    def put(self, filename, digests, key=None):
+        """cache digests of filename; key: its file_key() when hashed"""
+        key = key or self.file_key(filename)
+        self.conn.execute(
+            'INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?, ?)',
+            key + (os.path.abspath(filename),) + tuple(digests))
+        self.pending += 1
+        if self.pending >= 100:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+def _pool_checksums(filename):
+    """file_checksums for a pool worker: (filename, digests, error)"""
+    try:
+        return (filename, file_checksums(filename), None)
+    except Exception, e:
+        return (filename, None, '{}: {}'.format(type(e).__name__, e))
+
+
+def checksum_files(filenames, processes=None, cache=None):
+    """yield (filename, (md5, sha256), error) for each of filenames,
+       in order of completion, hashing `processes` files at once
+       (default: one per cpu).  error is None, or a message when the file
+       could not be read (its digests are then None).
+       With a ChecksumCache, unchanged files are yielded from it first, and
+       only new or modified files are read (and then cached).
+    """
+    filenames = list(filenames)
+    if cache is not None:
+        keys = {}
+        to_compute = []
+        for filename in filenames:
+            try:
+                keys[filename] = cache.file_key(filename)
+                digests = cache.get(filename, keys[filename])
+            except OSError:
+                digests = None
+            if digests:
+                yield (filename, digests, None)
+            else:
+                to_compute.append(filename)
+        log.info('Checksums cached for %s files, %s to compute',
+                 len(filenames) - len(to_compute), len(to_compute))
+        try:
+            for filename, digests, error in checksum_files(to_compute,
+                                                           processes):
+                if not error and filename in keys:
+                    cache.put(filename, digests, keys[filename])
+                yield (filename, digests, error)
+        finally:
+            cache.commit()
+        return
+
+    if not filenames:
+        return
+    processes = min(processes or cpu_count(), len(filenames))
+    if processes <= 1:
+        for filename in filenames:
+            yield _pool_checksums(filename)
+        return
+
+    log.info('Checksumming %s files with %s processes',
+             len(filenames), processes)
+    pool = Pool(processes)
+    try:
+        for result in pool.imap_unordered(_pool_checksums, filenames):
+            yield result
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
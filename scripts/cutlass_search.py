@@ -11,14 +11,19 @@ import os
 import json
 import importlib
 import time
+import hashlib
+import threading
+from collections import Counter
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Third Party ~~ Imports ~~~~
 import settings
 from cutlass_utils import format_query, load_data, write_out_csv, \
                           get_field_header, log_it, get_cur_datetime, \
-                          values_to_node_dict
+                          values_to_node_dict, get_csv_writer, \
+                          flush_csv_output
 from osdf import OSDF
 # for osdf.oql_query_all_pages, osdf.edit_node
+from osdf_client import get_pooled_osdf
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Constants ~~~~
 filename = os.path.basename(__file__)
@@ -69,6 +74,10 @@ NodeDict = {
                 'load_method': '', },
            }
 
+# columns of node retrieval csv's (see retrieve_query_all)
+RetrievalFields = ['node_type', 'id', 'internal_id', 'linkage', 'meta', 'ns',
+                   'ver', 'acl', 'date_retrieved']
+
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Internal Functions & Classes ~~~~
 
@@ -83,81 +92,137 @@ def byteify(input):
         return input
 
 
-def query_all_oql(session, namespace, node_type, query):
+def query_all_oql(session, namespace, node_type, query, workers=None):
     """use oql_query_all_pages for complete sets of results
     [ Requires pre-existing 'iHMPSession'! ]
     """
-    cumulative = session.get_osdf().oql_query_all_pages(namespace, query)
-    results = cumulative['results']
-    # meta = [ r['meta'] for r in results
-    #          if r['node_type'] == node_type ]
     nodes = {r['id']:r
+             for results in query_pages(session, query, namespace,
+                                        workers, ordered=False)
              for r in results
              if r['node_type'] == node_type}
     count = len(nodes)
     return (nodes, count)
 
 
-def query_all(session, query, namespace='ihmp'):
+def query_pages(session, query, namespace='ihmp', workers=None,
+                ordered=True):
+    """yield the results of each page of an OQL query as it is fetched,
+       so only one page is held at a time.
+       With `workers` > 1 (default: settings.query.page_workers), pages
+       after the first are fetched that many at once, and yielded in page
+       order, or as they arrive if not `ordered`.
+    [ Requires pre-existing 'iHMPSession'! (or a local_oql.LocalOql) ]
+    """
+    workers = workers or settings.query.page_workers
+    if workers > 1 and not getattr(session, 'is_local', False):
+        with get_pooled_osdf(session, max_in_flight=workers) as osdf:
+            for results in osdf.oql_query_pages(namespace, query, ordered):
+                yield results
+        return
+
+    osdf = session.get_osdf()
+    page = 1
+    fetched = 0
+    while True:
+        data = osdf.oql_query(namespace, query, page)
+        results = data.get('results', [])
+        if not results:
+            break
+        fetched += len(results)
+        log.debug('Query page %s: %s results', page, len(results))
+        yield results
+        # result_count is only this page's; without a total, page on
+        # until a page comes back empty
+        total = data.get('search_result_total')
+        if total is not None and fetched >= total:
+            break
+        page += 1
+
+
+def query_all(session, query, namespace='ihmp', workers=None):
     """use osdf.oql_query_all_pages for complete sets of results regardless of node_type
     [ Requires pre-existing 'iHMPSession'! ]
     """
     try:
-        cumulative = session.get_osdf().oql_query_all_pages(namespace, query)
-        results = cumulative['results']
-        nodes = {r['id']:r for r in results}
+        nodes = {r['id']:r
+                 for results in query_pages(session, query, namespace,
+                                            workers, ordered=False)
+                 for r in results}
     except Exception as e:
         raise e
     return nodes
 
 
-def retrieve_query_all(session, query, data_file='node_retrievals_.csv'):
-    """wrapper for 'query_all' to retrieve all matching node_types"""
-    log.info('Starting retrieval of ""%s".', query)
-
-    '''write headers if file ne or empty'''
-    fields = ['node_type', 'id', 'internal_id', 'linkage', 'meta', 'ns', 'ver', 'acl', 'date_retrieved']
-    log.warn('fields,%s', str(fields))
+def query_result_row(result, fields=RetrievalFields):
+    """csv row dict of fields from OQL query result node"""
+    node_type = result['node_type']
+    if node_type in NodeDict:
+        id_field = NodeDict[node_type]['id_field']
+        internal_id = result['meta'][id_field]
+    else:
+        internal_id = node_type
+    row = {'node_type': node_type,
+           'id': result['id'],
+           'internal_id': internal_id,
+           'linkage': json.dumps(result['linkage']),
+           'meta': json.dumps(result['meta']),
+           'ns': result['ns'],
+           'ver': result['ver'],
+           'acl': json.dumps(result['acl']),
+           'date_retrieved': get_cur_datetime(),
+          }
+    return dict((field, row[field]) for field in fields)
+
+
+def write_retrieval_csv(data_file, row_pages):
+    """write each list of row dicts (of RetrievalFields) in row_pages to
+       data_file as it arrives, through one buffered writer; return count
+    """
+    writer = get_csv_writer(data_file)
     try:
-        write_out_csv(data_file, fieldnames=fields)
+        '''write headers if file ne or empty'''
+        if os.path.getsize(data_file) <= 0:
+            writer.writeheader(RetrievalFields)
     except Exception as e:
         log.exception('Write headers, Except... %s', e)
 
-    results = query_all(session, query)
-    log.info("Number of Query Results: %s", len(results))
-    for node_id, result in results.iteritems():
-        try:
-            node_type = result['node_type']
-            if node_type in NodeDict:
-                id_field = NodeDict[node_type]['id_field']
-                internal_id = result['meta'][id_field]
-            else:
-                internal_id = node_type
-            # id_field = getattr(NodeDict, "[node_type]['id_field']", "unk")
-            # internal_id = getattr(result, "['meta'][id_field]", "unk")
-            log.debug('Current data node: %s', str(internal_id))
-            values = [node_type,
-                      node_id,
-                      internal_id,
-                      json.dumps(result['linkage']),
-                      json.dumps(result['meta']),
-                      result['ns'],
-                      result['ver'],
-                      json.dumps(result['acl']),
-                      get_cur_datetime(),
-                     ]
-            log.warn('vals,%s', str(values))
-            vals = values_to_node_dict([values], fields)
-            write_out_csv(data_file, fieldnames=fields, values=[vals])
-            write_out_csv(data_file, fieldnames=fields, values=[values])
+    count = 0
+    try:
+        for rows in row_pages:
+            writer.writerows(RetrievalFields, rows)
+            writer.flush(fsync=False)
+            count += len(rows)
+            log.info("Query results written: %s", count)
+    finally:
+        flush_csv_output(data_file)
+    return count
 
-        except Exception, e:
-            log.exception(e)
-            raise e
-    pass
 
+def retrieve_query_all(session, query, data_file='node_retrievals_.csv',
+                       workers=None):
+    """wrapper for 'query_all' to retrieve all matching node_types,
+       writing each page of results to data_file as it arrives
+    """
+    log.info('Starting retrieval of ""%s".', query)
 
-def query_all_nodes(session, node_name, node_type_name, query):
+    def row_pages():
+        for results in query_pages(session, query, workers=workers):
+            rows = []
+            for result in results:
+                try:
+                    rows.append(query_result_row(result, RetrievalFields))
+                    log.debug('Current data node: %s', rows[-1]['internal_id'])
+                except Exception, e:
+                    log.exception(e)
+                    raise e
+            yield rows
+
+    count = write_retrieval_csv(data_file, row_pages())
+    log.info("Number of Query Results: %s", count)
+
+
+def query_all_nodes(session, node_name, node_type_name, query, workers=None):
     """use oql_query_all_pages for complete sets of results"""
     NodeName = importlib.import_module('cutlass.'+node_name)
     log.debug('NodeName: %s', NodeName)
@@ -165,7 +230,7 @@ def query_all_nodes(session, node_name, node_type_name, query):
     # log.debug('NodeObject: %s', NodeObject)
     NameSpace = getattr(NodeObject, 'namespace')
     # log.debug('NameSpace: %s', NameSpace)
-    return query_all_oql(session, NameSpace, node_type_name, query)
+    return query_all_oql(session, NameSpace, node_type_name, query, workers)
 
 
 def retrieve_nodes(session, data_file, node_type):
@@ -225,73 +290,210 @@ def import_node_and_loader(session, node_name, load_method_name):
     return NodeObject, NodeLoader
 
 
-def update_node(session, record, node_type):
-    """update existing node with new info field values"""
+def pipeline_osdf_calls(session, workers, func, items):
+    """call func(item, osdf) for each of items, with up to `workers`
+       requests in flight over pooled keep-alive OSDF connections
+    """
+    with get_pooled_osdf(session, max_in_flight=workers) as osdf:
+        pending = [osdf.submit(func, item, osdf) for item in items]
+        for result in pending:
+            result.get()
+
+
+def node_content_hash(meta, linkage):
+    """sha1 of meta and linkage, serialized canonically (sorted keys),
+       so equal contents hash equal regardless of key order
+    """
+    content = json.dumps({'meta': meta, 'linkage': linkage},
+                         sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def node_field_diffs(current, desired):
+    """sorted 'meta.<field>' and 'linkage.<field>' names whose values
+       differ between current and desired node dicts
+    """
+    diffs = []
+    for part in ('meta', 'linkage'):
+        old = current.get(part) or {}
+        new = desired.get(part) or {}
+        diffs.extend('{}.{}'.format(part, field)
+                     for field in set(old) | set(new)
+                     if old.get(field) != new.get(field))
+    return sorted(diffs)
+
+
+def load_retrieved_nodes(*data_files):
+    """dict of node id: node, from node retrieval csv's (retrieve_query_all)
+       of today; rows retrieved on other days are left out, as stale
+    """
+    from local_oql import retrieval_node
+    today = get_cur_datetime()[:10]
+    nodes = {}
+    stale = 0
+    for data_file in data_files:
+        for row in load_data(data_file):
+            if not row.get('date_retrieved', '').startswith(today):
+                stale += 1
+                continue
+            nodes[row['id']] = retrieval_node(row)
+    log.info('Loaded %s nodes retrieved today, skipped %s older', len(nodes),
+             stale)
+    return nodes
+
+
+class UpdatePlan(object):
+    """Counts of update_node outcomes, and of the fields changed, for a run
+       of updates.  `current`: dict of node id: node as now on the server
+       (see load_retrieved_nodes); nodes found unchanged against it are
+       skipped without a get_node.  With dry_run, changes are logged and
+       counted but not sent.
+    """
+
+    def __init__(self, current=None, dry_run=False):
+        self.current = current or {}
+        self.dry_run = dry_run
+        self.counts = Counter()
+        self.field_counts = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, outcome, fields=()):
+        with self.lock:
+            self.counts[outcome] += 1
+            self.field_counts.update(fields)
+
+    def log_summary(self):
+        log.info('Node updates: %s', ', '.join(
+            '{} {}'.format(count, outcome)
+            for outcome, count in sorted(self.counts.items())))
+        for field, count in self.field_counts.most_common():
+            log.info('  changed %s: %s nodes', field, count)
+
+
+def desired_node(node, record):
+    """copy of node dict with the record's meta and linkage (where given)"""
+    desired = dict(node)
+    if record['linkage']:
+        desired['linkage'] = json.loads(record['linkage'])
+    if record['meta']:
+        desired['meta'] = json.loads(record['meta'])
+    return desired
+
+
+def unchanged(node, desired):
+    return node_content_hash(node.get('meta'), node.get('linkage')) == \
+           node_content_hash(desired.get('meta'), desired.get('linkage'))
+
+
+def update_node(session, record, node_type, osdf=None, plan=None):
+    """update existing node with new info field values, unless they are
+       the same as the node's (on the server, or in plan.current)
+    """
     log.info('Starting update of %ss.', node_type)
-    osdf = session.get_osdf()
+    osdf = osdf or session.get_osdf()
+    plan = plan or UpdatePlan()
 
     node_id = record['node_id']
+    internal_id = record['internal_id']
     try:
+        known = plan.current.get(node_id)
+        if known and unchanged(known, desired_node(known, record)):
+            log.info('Unchanged %s node: %s', node_type, str(internal_id))
+            plan.record('unchanged')
+            return
+
         log.info('Checking for %s node: %s', node_type, node_id)
         result = osdf.get_node(node_id)
         # log.warn("node result: %s", result)
         if result:
-            internal_id = record['internal_id']
-            # internal_id = result['meta']['comment']
-            log.info('Updating %s node: %s', node_type, str(internal_id))
-            # log.debug('linkage: %s', record['linkage'] )
-            if record['linkage']:
-                result['linkage'] = json.loads(record['linkage'])
-            if record['meta']:
-                result['meta'] = json.loads(record['meta'])
-            # log.warn('node update: %s', result)
+            desired = desired_node(result, record)
+            if unchanged(result, desired):
+                log.info('Unchanged %s node: %s', node_type, str(internal_id))
+                plan.record('unchanged')
+                return
+            fields = node_field_diffs(result, desired)
+            log.info('Updating %s node: %s (%s)', node_type, str(internal_id),
+                     ', '.join(fields))
+            if plan.dry_run:
+                plan.record('to update', fields)
+                return
             try:
-                osdf.edit_node(result)
+                osdf.edit_node(desired)
                 log.info("Saved updated %s: %s, %s", node_type, node_id, internal_id)
+                plan.record('updated', fields)
             except Exception, e:
                 log.exception('node update problem: %s', e)
+                plan.record('failed')
                 # raise e
         else:
             log.info('unable to get_node: %s', node_id)
+            plan.record('missing')
 
     except Exception, e:
         log.exception(e)
+        plan.record('failed')
         # raise e
 
 
-def update_nodes(session, data_file, node_type):
+def update_nodes(session, data_file, node_type, workers=1, plan=None):
     """Retrieve node info for each 'internal_id' found in search()
+       plan: UpdatePlan, for its current nodes, dry_run and counts
     """
     log.info('Starting updates of %ss.', node_type)
     data_file_log = data_file + '.updated.csv'
+    plan = plan or UpdatePlan()
+
+    if workers > 1:
+        pipeline_osdf_calls(
+            session, workers,
+            lambda record, osdf: update_node(session, record, node_type, osdf,
+                                             plan),
+            load_data(data_file))
+        plan.log_summary()
+        return plan
 
     for record in load_data(data_file):
         try:
             # log.debug("record: %s", record)
-            update_node(session, record, node_type)
+            update_node(session, record, node_type, plan=plan)
         except Exception, e:
             log.exception(e)
             raise e
+    plan.log_summary()
+    return plan
 
 
-def update_nodes_general(session, data_file):
+def update_nodes_general(session, data_file, workers=1, plan=None):
     """Retrieve node info for each 'internal_id' found in search()
+       plan: UpdatePlan, for its current nodes, dry_run and counts
     """
     data_file_log = data_file + '.updated.csv'
+    plan = plan or UpdatePlan()
+
+    if workers > 1:
+        pipeline_osdf_calls(
+            session, workers,
+            lambda record, osdf: update_node(session, record,
+                                             record['node_type'], osdf, plan),
+            load_data(data_file))
+        plan.log_summary()
+        return plan
 
     for record in load_data(data_file):
         try:
             log.info('Starting updates of %ss.', record['node_type'])
             # log.debug("record: %s", record)
-            update_node(session, record, record['node_type'])
+            update_node(session, record, record['node_type'], plan=plan)
         except Exception, e:
             log.exception(e)
             raise e
+    plan.log_summary()
+    return plan
 
 
-def delete_node(session, node_id):
+def delete_node(session, node_id, osdf=None):
     """delete existing node """
-    osdf = session.get_osdf()
+    osdf = osdf or session.get_osdf()
     try:
         log.info('Starting delete of node with id: %s.', node_id)
         if osdf.get_node(node_id):
@@ -302,9 +504,16 @@ def delete_node(session, node_id):
         # raise e
 
 
-def delete_nodes(session, node_ids):
+def delete_nodes(session, node_ids, workers=1):
     """Delete all nodes in passed dict"""
     log.info('Starting deletions of nodes')
+    if workers > 1:
+        pipeline_osdf_calls(
+            session, workers,
+            lambda node_id, osdf: delete_node(session, node_id, osdf),
+            node_ids.values())
+        return
+
     for internal_id, node_id in node_ids.iteritems():
         try:
             delete_node(session, node_id)
@@ -8,6 +8,9 @@ import yaml
 import logging
 import time
 import importlib
+import threading
+import atexit
+import hashlib
 
 import cutlass
 
@@ -91,13 +94,47 @@ def get_cur_datetime():
     return time.strftime("%Y-%m-%d %H:%M")
 
 
+# csv path -> (mtime, size, fieldnames); shared by the csv readers/writers
+_field_headers = {}
+_field_headers_lock = threading.Lock()
+
+def _file_stamp(csv_file):
+    try:
+        st = os.stat(csv_file)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+def _cached_field_header(csv_file):
+    """fieldnames cached for csv_file if it is unchanged since, else None"""
+    with _field_headers_lock:
+        cached = _field_headers.get(os.path.abspath(csv_file))
+    if cached and cached[0] == _file_stamp(csv_file):
+        return list(cached[1])
+    return None
+
+def _cache_field_header(csv_file, fieldnames, stamp=None):
+    stamp = stamp or _file_stamp(csv_file)
+    if stamp and fieldnames:
+        with _field_headers_lock:
+            _field_headers[os.path.abspath(csv_file)] = \
+                    (stamp, list(fieldnames))
+
 def get_field_header(csv_file):
-    """returns first row of csv file as list of fieldnames"""
+    """returns first row of csv file as list of fieldnames
+       (cached until the file's mtime or size changes)
+    """
+    fieldnames = _cached_field_header(csv_file)
+    if fieldnames is not None:
+        return fieldnames
     log.info('Loading fields from {}'.format(csv_file))
+    stamp = _file_stamp(csv_file)
     with open(csv_file, 'rU') as csvfh:
         try:
             reader = csv.DictReader(csvfh)
-            return list(reader.fieldnames)
+            fieldnames = list(reader.fieldnames)
+            _cache_field_header(csv_file, fieldnames, stamp)
+            return fieldnames
         except csv.Error as e:
             log.exception('Reading CSV file %s, line %d: %s',
                     csv_file, reader.line_num, e)
@@ -107,11 +144,14 @@ def load_data(csv_file,  delim=',', quotechar='"'):
     """yield row dicts from csv_file using DictReader
     """
     log.info('Loading rows from {}'.format(csv_file))
+    stamp = _file_stamp(csv_file)
     with open(csv_file, 'rU') as csvfh:
         reader = csv.DictReader(csvfh, dialect='excel',
                                 delimiter=delim, quotechar=quotechar)
         # log.debug('csv dictreader opened')
         try:
+            if delim == ',' and reader.fieldnames:
+                _cache_field_header(csv_file, reader.fieldnames, stamp)
             for row in reader:
                 # log.debug(row)
                 yield row
@@ -133,13 +173,160 @@ def csv_type_sniff(csv_file):
 id_fields = settings.node_id_tracking.id_fields
 # sample: subject,69-01,610a491c,study,prediabetes,610a4911a5c
 
+# serializes csv appends from concurrent submit_record threads
+_csv_write_lock = threading.RLock()
+
+class CsvFileWriter(object):
+    """Append handle kept open on one csv file, batching rows.
+       Buffered rows are written out once `batch_rows` are waiting or
+       `flush_seconds` have passed since the last write (checked as rows
+       arrive), on flush(), and at exit; each batch is fsync'ed, so a crash
+       loses at most the rows of one batch.
+    """
+
+    def __init__(self, csv_file, batch_rows=100, flush_seconds=5):
+        self.csv_file = csv_file
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.rows = []
+        self.writers = {}
+        self.last_flush = time.time()
+        self.lock = threading.RLock()
+        self.fh = open(csv_file, 'a')
+
+    def _writer(self, fieldnames):
+        key = tuple(fieldnames)
+        if key not in self.writers:
+            self.writers[key] = csv.DictWriter(self.fh, fieldnames)
+        return self.writers[key]
+
+    def writeheader(self, fieldnames):
+        """write header now, so readers of the file see it at once"""
+        with self.lock:
+            self.flush(fsync=False)
+            empty = os.fstat(self.fh.fileno()).st_size == 0
+            self._writer(fieldnames).writeheader()
+            self.fh.flush()
+            if empty:
+                _cache_field_header(self.csv_file, fieldnames)
+
+    def writerows(self, fieldnames, values):
+        rows = [row for row in values if isinstance(row, dict)]
+        for row in rows:
+            # raise now, as csv.DictWriter would, not at a later flush
+            wrong_fields = [k for k in row if k not in fieldnames]
+            if wrong_fields:
+                raise ValueError('dict contains fields not in fieldnames: '
+                                 + ', '.join(repr(x) for x in wrong_fields))
+        with self.lock:
+            self.rows.extend((fieldnames, row) for row in rows)
+            if len(self.rows) >= self.batch_rows or \
+                    time.time() - self.last_flush >= self.flush_seconds:
+                self.flush()
+
+    def flush(self, fsync=True):
+        """write out buffered rows, then fsync them to disk"""
+        with self.lock:
+            if self.rows:
+                # taken out first, so no row can be written twice
+                rows, self.rows = self.rows, []
+                header = _cached_field_header(self.csv_file)
+                log.info('Writing %s csv rows to %s',
+                         len(rows), self.csv_file)
+                for fieldnames, row in rows:
+                    log.debug(row)
+                    self._writer(fieldnames).writerow(row)
+                self.fh.flush()
+                if fsync:
+                    os.fsync(self.fh.fileno())
+                if header:
+                    _cache_field_header(self.csv_file, header)
+            self.last_flush = time.time()
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.fh.close()
+
+
+# csv path -> CsvFileWriter, for the life of the run
+_csv_writers = {}
+# .files: set of csv paths given rows by this thread, while collected
+# (see csv_files_written)
+_csv_written = threading.local()
+
+def get_csv_writer(csv_file):
+    """CsvFileWriter registered for csv_file, opened on first use"""
+    key = os.path.abspath(csv_file)
+    with _csv_write_lock:
+        if key not in _csv_writers:
+            _csv_writers[key] = CsvFileWriter(
+                    csv_file,
+                    batch_rows=settings.csv_output.batch_rows,
+                    flush_seconds=settings.csv_output.flush_seconds)
+        return _csv_writers[key]
+
+def flush_csv_output(csv_file=None, fsync=True):
+    """write out rows buffered for csv_file (or all files): a checkpoint"""
+    with _csv_write_lock:
+        if csv_file is None:
+            writers = list(_csv_writers.values())
+        else:
+            writers = [_csv_writers.get(os.path.abspath(csv_file))]
+    for writer in writers:
+        if writer:
+            writer.flush(fsync=fsync)
+
+def csv_files_written(collect=True):
+    """start (or with collect False, stop) collecting the csv files this
+       thread gives buffered rows; return those collected until now
+    """
+    files = getattr(_csv_written, 'files', None) or set()
+    _csv_written.files = set() if collect else None
+    return files
+
+@atexit.register
+def close_csv_output():
+    """flush and close all registered csv writers"""
+    with _csv_write_lock:
+        writers = list(_csv_writers.values())
+        _csv_writers.clear()
+    for writer in writers:
+        try:
+            writer.close()
+        except Exception as e:
+            log.exception('Error closing CSV file %s, %s',
+                          writer.csv_file, str(e))
+
+
 def write_out_csv(csv_file,fieldnames=id_fields,values=[]):
     """write all values in csv format to outfile.
     Values is list of dicts w/ keys matching fieldnames.
     To write header to file, omit `values`
+    With settings.csv_output.buffered, rows go through the file's
+    CsvFileWriter; call flush_csv_output() where they must be on disk.
     """
+    if settings.csv_output.buffered:
+        writer = get_csv_writer(csv_file)
+        if values:
+            writer.writerows(fieldnames, values)
+            files = getattr(_csv_written, 'files', None)
+            if files is not None:
+                files.add(csv_file)
+        else:
+            log.info('Writing header of fieldnames to {}'.format(csv_file))
+            writer.writeheader(fieldnames)
+        return
+
     try:
-        with open(csv_file, 'a') as csvout:
+        with _csv_write_lock, open(csv_file, 'a') as csvout:
+            # appending rows leaves a cached header valid; a header written
+            # to an empty file becomes it
+            if values:
+                header = _cached_field_header(csv_file)
+            else:
+                empty = os.fstat(csvout.fileno()).st_size == 0
+                header = fieldnames if empty else None
             writer = csv.DictWriter(csvout, fieldnames)
             if values:
                 log.info('Writing csv to {}'.format(csv_file))
@@ -155,6 +342,9 @@ def write_out_csv(csv_file,fieldnames=id_fields,values=[]):
             else:
                 log.info('Writing header of fieldnames to {}'.format(csv_file))
                 writer.writeheader()
+            csvout.flush()
+            if header:
+                _cache_field_header(csv_file, header)
     except IOError as e:
         raise e
 
@@ -201,66 +391,687 @@ def values_to_node_dict(values=[], keynames=id_fields):
 # values_to_node_dict([['foo','bar','1'],['spam','eggs','2','spoof','filled']])
 
 
+class NodeTrackingIndex(object):
+    """in-memory index of the node id tracking csv, keyed by
+       (node_type, internal_id); the first row written for a key wins.
+       Rows appended to the file after loading (e.g. by write_out_csv, mid-run)
+       are read in from the last offset whenever a lookup misses.
+    """
+    def __init__(self, id_file_name):
+        self.id_file_name = id_file_name
+        self.fieldnames = None
+        self.offset = 0
+        self.split_crlf = False  # last read ended between '\r' and '\n'
+        self.nodes = {}
+        self.children = {}
+        self.by_type = {}
+        self.lock = threading.RLock()
+        self.refresh()
+
+    def reset(self):
+        self.fieldnames = None
+        self.offset = 0
+        self.split_crlf = False
+        self.nodes.clear()
+        self.children.clear()
+        self.by_type.clear()
+
+    def add_row(self, row):
+        """index a single tracking row dict"""
+        node_type = row['node_type'].lower()
+        self.nodes.setdefault((node_type, row['internal_id']), row)
+        self.children.setdefault(
+            (node_type, row['parent_node_id']), []).append(row)
+        self.by_type.setdefault(node_type, []).append(row)
+
+    def refresh(self):
+        """read rows appended to tracking file since last read,
+           return number of rows added to index
+        """
+        with self.lock:
+            return self._refresh()
+
+    def _refresh(self):
+        try:
+            size = os.path.getsize(self.id_file_name)
+        except OSError:
+            return 0
+        if size < self.offset:
+            log.info('Tracking file shrank, re-indexing: %s',
+                     self.id_file_name)
+            self.reset()
+        if size == self.offset:
+            return 0
+
+        with open(self.id_file_name, 'rb') as csvfh:
+            csvfh.seek(self.offset)
+            chunk = csvfh.read()
+        if self.split_crlf and chunk.startswith('\n'):
+            chunk = chunk[1:]
+            self.offset += 1
+        # only consume complete lines ('\n', '\r\n' or '\r' ended);
+        # a partial row is picked up next time
+        end = max(chunk.rfind('\n'), chunk.rfind('\r')) + 1
+        if not end:
+            return 0
+        self.split_crlf = chunk[end - 1] == '\r'
+        lines = [line.rstrip('\r\n') + '\n'
+                 for line in chunk[:end].splitlines()]
+        self.offset += end
+
+        if self.fieldnames is None:
+            self.fieldnames = next(csv.reader(lines[:1]))
+            lines = lines[1:]
+        added = 0
+        try:
+            for row in csv.DictReader(lines, fieldnames=self.fieldnames):
+                self.add_row(row)
+                added += 1
+        except csv.Error as e:
+            log.exception('Reading CSV file %s: %s', self.id_file_name, e)
+        log.debug('Indexed %s tracking rows from %s',
+                  added, self.id_file_name)
+        return added
+
+    def get(self, node_type, internal_id):
+        """return tracking row for node_type, internal_id, else None"""
+        key = (node_type.lower(), internal_id)
+        if key not in self.nodes:
+            self.refresh()
+        return self.nodes.get(key)
+
+    def get_prefixed(self, node_type, prefix):
+        """return first tracking row of node_type whose internal_id
+           starts with prefix, else None
+        """
+        self.refresh()
+        for row in self.by_type.get(node_type.lower(), []):
+            if row['internal_id'].startswith(prefix):
+                return row
+
+    def get_children(self, node_type, parent_node_id):
+        """return list of tracking rows of node_type under parent_node_id"""
+        self.refresh()
+        return self.children.get((node_type.lower(), parent_node_id), [])
+
+    def append(self, values):
+        """append list of row dicts to tracking csv, then index them"""
+        with self.lock:
+            if not os.path.exists(self.id_file_name):
+                write_out_csv(self.id_file_name, fieldnames=id_fields)
+            write_out_csv(self.id_file_name,
+                          fieldnames=self.fieldnames or id_fields,
+                          values=values)
+            flush_csv_output(self.id_file_name, fsync=False)
+            self._refresh()
+
+
+class SqliteNodeTracking(object):
+    """node id tracking store in an SQLite db, indexed on
+       (node_type, internal_id) and parent_node_id; same lookups as
+       NodeTrackingIndex.  WAL journaling lets several submitters share
+       the one db file while reading.
+       Rows appended are also written to csv_file, if given, for the
+       scripts that read the tracking csv.
+    """
+    table = 'node_tracking'
+
+    def __init__(self, db_file, csv_file=None, timeout=60):
+        import sqlite3
+        self.db_file = db_file
+        self.csv_file = csv_file
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, timeout=timeout,
+                                    check_same_thread=False)
+        self.conn.text_factory = str
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS {} ({})'.format(
+                    self.table, ', '.join(f + ' TEXT' for f in id_fields)))
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS {0}_node_idx '
+                'ON {0} (node_type, internal_id)'.format(self.table))
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS {0}_parent_idx '
+                'ON {0} (parent_node_id)'.format(self.table))
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute(
+                'SELECT count(*) FROM {}'.format(self.table)).fetchone()[0]
+
+    def select(self, where, args, limit=None):
+        sql = 'SELECT {} FROM {} WHERE {} ORDER BY rowid'.format(
+            ', '.join(id_fields), self.table, where)
+        if limit:
+            sql += ' LIMIT {:d}'.format(limit)
+        with self.lock:
+            return [dict(zip(id_fields, row))
+                    for row in self.conn.execute(sql, args)]
+
+    def get(self, node_type, internal_id):
+        """return tracking row for node_type, internal_id, else None"""
+        rows = self.select('node_type = ? AND internal_id = ?',
+                           (node_type.lower(), internal_id), limit=1)
+        return rows[0] if rows else None
+
+    def get_prefixed(self, node_type, prefix):
+        """return first tracking row of node_type whose internal_id
+           starts with prefix, else None
+        """
+        rows = self.select('node_type = ? AND substr(internal_id, 1, ?) = ?',
+                           (node_type.lower(), len(prefix), prefix), limit=1)
+        return rows[0] if rows else None
+
+    def get_children(self, node_type, parent_node_id):
+        """return list of tracking rows of node_type under parent_node_id"""
+        return self.select('parent_node_id = ? AND node_type = ?',
+                           (parent_node_id, node_type.lower()))
+
+    def _insert(self, values):
+        rows = [tuple(row.get(f, '') if f != 'node_type'
+                      else row.get(f, '').lower()
+                      for f in id_fields)
+                for row in values if isinstance(row, dict)]
+        self.conn.executemany(
+            'INSERT INTO {} ({}) VALUES ({})'.format(
+                self.table, ', '.join(id_fields),
+                ', '.join('?' * len(id_fields))),
+            rows)
+        return len(rows)
+
+    def append(self, values):
+        """insert list of row dicts, as one transaction, and add them to
+           csv_file
+        """
+        with self.lock:
+            with self.conn:
+                count = self._insert(values)
+            if self.csv_file:
+                if not os.path.exists(self.csv_file):
+                    write_out_csv(self.csv_file, fieldnames=id_fields)
+                write_out_csv(self.csv_file, fieldnames=id_fields,
+                              values=values)
+                flush_csv_output(self.csv_file, fsync=False)
+        log.debug('Tracked %s rows in %s', count, self.db_file)
+
+    def import_csv(self, csv_file, if_empty=False):
+        """load all rows of tracking csv_file into db; with if_empty, only
+           if the db has no rows yet.  The check and the inserts are one
+           immediate transaction, so of several submitters opening a new db
+           at once only the first imports.  Return number of rows imported.
+        """
+        with self.lock:
+            self.conn.commit()
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                if if_empty and self.conn.execute(
+                        'SELECT count(*) FROM {}'.format(
+                            self.table)).fetchone()[0]:
+                    count = 0
+                else:
+                    log.info('Importing tracking rows from {}'.format(
+                        csv_file))
+                    count = self._insert(load_data(csv_file))
+            except Exception:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+        return count
+
+    def export_csv(self, csv_file):
+        """write all db rows to tracking csv_file, with header"""
+        log.info('Exporting tracking rows to {}'.format(csv_file))
+        write_out_csv(csv_file, fieldnames=id_fields)
+        with self.lock:
+            rows = [dict(zip(id_fields, row)) for row in self.conn.execute(
+                'SELECT {} FROM {} ORDER BY rowid'.format(
+                    ', '.join(id_fields), self.table))]
+        write_out_csv(csv_file, fieldnames=id_fields, values=rows)
+        flush_csv_output(csv_file)
+        return len(rows)
+
+
+_tracking_indexes = {}
+
+def get_tracking_index(id_file_name):
+    """return the (loaded-once) tracking store for id_file_name;
+       backend chosen by settings.node_id_tracking.backend:
+         'csv':    NodeTrackingIndex over id_file_name itself
+         'sqlite': SqliteNodeTracking in id_file_name's '.db' sibling,
+                   imported from id_file_name when the db is first created;
+                   new rows are still appended to id_file_name
+    """
+    path = os.path.abspath(id_file_name)
+    if path not in _tracking_indexes:
+        backend = getattr(settings.node_id_tracking, 'backend', 'csv')
+        if backend == 'sqlite':
+            db_file = os.path.splitext(path)[0] + '.db'
+            log.info('Opening node tracking db {}'.format(db_file))
+            store = SqliteNodeTracking(db_file, csv_file=id_file_name)
+            if os.path.exists(path):
+                store.import_csv(path, if_empty=True)
+        else:
+            log.info('Indexing node tracking file {}'.format(id_file_name))
+            store = NodeTrackingIndex(id_file_name)
+        _tracking_indexes[path] = store
+    return _tracking_indexes[path]
+
+
+def write_tracking_rows(id_file_name, values):
+    """add list of tracking row dicts to the tracking store of id_file_name"""
+    get_tracking_index(id_file_name).append(values)
+
+
 def get_parent_node_id(id_file_name, node_type, parent_id):
-    """ read node ids from csv tracking file
-        return first "parent" node matching node_type
+    """ lookup node ids from tracking store
+        return first "parent" node matching node_type; parent_id may be only
+        the start of the tracked internal_id (e.g. a raw_file_id of a tracked
+        file name), as the tracking file was once matched by prefix
     """
     log.debug('--> args: '+ id_file_name +','+ node_type +','+ parent_id)
-    try:
-        for row in load_data(id_file_name):
-            # log.debug('--> checking node row: '+ str(row))
-            if re.match(node_type.lower(),row['node_type']):
-                # node_ids.append(row.parent_id)
-                if re.match(parent_id,row['internal_id']):
-                    # log.debug('--> matching node row: '+ str(row))
-                    # log.debug('parent type: {}, osdf_node_id: {}'.format(
-                    #     node_type,str(row['osdf_node_id'])))
-                    return row['osdf_node_id']
-                # else:
-                    # log.debug('--> no match node row for: '+ str(parent_id))
-                    # return None
-            # else:
-                # log.debug('--> no match node row: '+ str(node_type))
-                # return None
-    except Exception as e:
-        raise e
+    store = get_tracking_index(id_file_name)
+    row = store.get(node_type, parent_id)
+    if not row and parent_id:
+        row = store.get_prefixed(node_type, parent_id)
+        if row:
+            log.debug('prefix matched parent %s: %s',
+                      parent_id, row['internal_id'])
+    if row:
+        return row['osdf_node_id']
 
 
 def get_node_id(id_file_name, node_type, node_id):
-    """ read node ids from csv tracking file
+    """ lookup node ids from tracking store
         return node id matching node_type
     """
-    try:
-        for row in load_data(id_file_name):
-            if re.match(node_type,row['node_type']):
-                if re.match(node_id,row['internal_id']):
-                    log.debug('matching, node type: {}, osdf_node_id: {}'.format(
-                        node_type,str(row['osdf_node_id'])))
-                    return row['osdf_node_id']
-    except Exception as e:
-        raise e
+    row = get_tracking_index(id_file_name).get(node_type, node_id)
+    if row:
+        log.debug('matching, node type: {}, osdf_node_id: {}'.format(
+            node_type,str(row['osdf_node_id'])))
+        return row['osdf_node_id']
 
 
-def get_child_node_ids(id_file_name, node_type, parent_id):
-    """ read node ids from csv tracking file
+def get_child_node_ids(id_file_name, node_type, parent_node_id):
+    """ lookup node ids from tracking store
         yield "child" node ids matching node_type
     """
+    for row in get_tracking_index(id_file_name).get_children(
+            node_type, parent_node_id):
+        yield row['osdf_node_id']
+
+class SubmissionCheckpoint(object):
+    """Records saved from data_file, kept in 'data_file.checkpoint' as lines
+       of "row number<TAB>record hash", fsync'ed as each is added.
+       A record counts as done only at the same row with the same content,
+       so rows edited or moved in the data file are submitted again.
+    """
+
+    def __init__(self, data_file):
+        self.path = data_file + '.checkpoint'
+        self.lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as fh:
+                for line in fh:
+                    if line.endswith('\n'):
+                        self.done.add(tuple(line.rstrip('\n').split('\t')))
+        self.fh = None
+
+    @staticmethod
+    def record_hash(record):
+        """sha1 of record's (field, value) pairs, in field order, as bytes;
+           values need not be valid UTF-8
+        """
+        digest = hashlib.sha1()
+        for item in sorted(record.items()):
+            for value in item:
+                if isinstance(value, type(u'')):
+                    value = value.encode('utf-8')
+                elif not isinstance(value, str):
+                    value = repr(value)
+                digest.update(value + '\0')
+        return digest.hexdigest()
+
+    def is_done(self, row_num, record):
+        return (str(row_num), self.record_hash(record)) in self.done
+
+    def mark_done(self, row_num, record, csv_files=()):
+        """checkpoint record, once the csv_files it wrote rows to are
+           flushed to disk
+        """
+        entry = (str(row_num), self.record_hash(record))
+        # the record's csv output must be on disk before it is skipped
+        for csv_file in csv_files:
+            flush_csv_output(csv_file)
+        with self.lock:
+            if self.fh is None:
+                self.fh = open(self.path, 'ab')
+            self.fh.write('\t'.join(entry) + '\n')
+            self.fh.flush()
+            os.fsync(self.fh.fileno())
+            self.done.add(entry)
+
+    def close(self):
+        with self.lock:
+            if self.fh is not None:
+                self.fh.close()
+                self.fh = None
+
+
+def run_submissions(submit_record, records, workers=None, data_file=None,
+                    key=None, lookup=None):
+    """call submit_record(record) for each of records;
+       serially if workers <= 1, else on a pool of `workers` threads so that
+       many records' OSDF searches and saves are in flight at once.
+       workers defaults to settings.submission.workers.
+       Records with the same key(record), e.g. the internal id of the node
+       they submit, are run one after another, in order, on one thread, so
+       a repeated id cannot create two nodes.
+       With settings.submission.lookup_ahead, the existing nodes of all
+       records are first looked up at once (see load_nodes), by the
+       (search_field, node_type) of lookup, with key(record) as internal id.
+       An exception raised by submit_record stops the run, as when serial.
+       With settings.submission.resume, records of data_file for which
+       submit_record returned true (saved) are checkpointed, and skipped
+       without any OSDF calls when the data file is run again.
+       Buffered csv output is flushed to disk when the run ends.
+       Return list of submit_record's results, in the order of records
+       (None for records skipped).
+    """
+    if workers is None:
+        workers = settings.submission.workers
+    records = list(records)
+    results = [None] * len(records)
+    pending = range(len(records))
+    checkpoint = None
+    if data_file and settings.submission.resume:
+        checkpoint = SubmissionCheckpoint(data_file)
+        pending = [i for i in pending
+                   if not checkpoint.is_done(i + 1, records[i])]
+        log.info('Skipped %s records checkpointed in %s',
+                 len(records) - len(pending), checkpoint.path)
+    if lookup and key and pending and settings.submission.lookup_ahead \
+            and not settings.submission.prefetch:
+        search_field, node_type = lookup
+        load_nodes(set(key(records[i]) for i in pending),
+                   search_field, node_type)
+
+    def submit_rows(rows):
+        for i in rows:
+            if not checkpoint:
+                results[i] = submit_record(records[i])
+                continue
+            csv_files_written()
+            try:
+                results[i] = submit_record(records[i])
+            finally:
+                csv_files = csv_files_written(collect=False)
+            if results[i]:
+                checkpoint.mark_done(i + 1, records[i], csv_files)
+
     try:
-        for row in load_data(id_file_name):
-            if re.match(node_type,row['node_type']):
-                if re.match(parent_id,row['internal_id']):
-                    log.debug('--> matching node row: '+ str(row))
-                    log.debug('parent type: {}, osdf_node_id: {}'.format(
-                        node_type,str(row['osdf_node_id'])))
-                    return row['osdf_node_id']
-    except Exception as e:
-        raise e
+        if workers <= 1:
+            submit_rows(pending)
+        else:
+            _run_pooled(submit_rows, _key_groups(records, pending, key),
+                        workers)
+    finally:
+        flush_csv_output()
+        if checkpoint:
+            checkpoint.close()
+    return results
+
+def _key_groups(records, rows, key):
+    """list of lists of rows (indexes of records) with the same
+       key(record), in order; each row on its own without key
+    """
+    from collections import OrderedDict
+    if key is None:
+        return [[i] for i in rows]
+    groups = OrderedDict()
+    for i in rows:
+        groups.setdefault(key(records[i]), []).append(i)
+    return groups.values()
+
+def _run_pooled(submit_rows, groups, workers):
+    from multiprocessing.pool import ThreadPool
+    log.info('Submitting records with %s worker threads', workers)
+    pool = ThreadPool(workers)
+    try:
+        for _ in pool.imap_unordered(submit_rows, groups):
+            pass
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+
+# cutlass class name -> OSDF 'node_type'
+osdf_node_types = {
+    'Subject': 'subject',
+    'Visit': 'visit',
+    'Sample': 'sample',
+    'SixteenSDnaPrep': '16s_dna_prep',
+    'SixteenSRawSeqSet': '16s_raw_seq_set',
+    'SixteenSTrimmedSeqSet': '16s_trimmed_seq_set',
+    'WgsDnaPrep': 'wgs_dna_prep',
+    'WgsRawSeqSet': 'wgs_raw_seq_set',
+    'MicrobTranscriptomicsRawSeqSet': 'microb_transcriptomics_raw_seq_set',
+    'HostAssayPrep': 'host_assay_prep',
+    'HostSeqPrep': 'host_seq_prep',
+    'HostWgsRawSeqSet': 'host_wgs_raw_seq_set',
+    'HostTranscriptomicsRawSeqSet': 'host_transcriptomics_raw_seq_set',
+    'Metabolome': 'metabolome',
+    'Proteome': 'proteome',
+    }
+
+# cutlass class name -> its static method loading a node from OSDF json
+osdf_json_loaders = {
+    'Subject': 'load_subject',
+    'Visit': 'load_visit',
+    'Sample': 'load_sample',
+    'SixteenSDnaPrep': 'load_sixteenSDnaPrep',
+    'SixteenSRawSeqSet': 'load_16s_raw_seq_set',
+    'SixteenSTrimmedSeqSet': 'load_sixteenSTrimmedSeqSet',
+    'WgsDnaPrep': 'load_wgsDnaPrep',
+    'WgsRawSeqSet': 'load_wgsRawSeqSet',
+    'MicrobTranscriptomicsRawSeqSet': 'load_microb_transcriptomics_raw_seq_set',
+    'HostAssayPrep': 'load_host_assay_prep',
+    'HostSeqPrep': 'load_host_seq_prep',
+    'HostWgsRawSeqSet': 'load_hostWgsRawSeqSet',
+    'HostTranscriptomicsRawSeqSet': 'load_host_transcriptomics_raw_set_set',
+    'Metabolome': 'load_metabolome',
+    'Proteome': 'load_proteome',
+    }
+
+def json_loader(node_type):
+    """function of cutlass class node_type making a node of its OSDF json
+       (not the loader by node id, e.g. Visit.load)
+    """
+    NodeType = importlib.import_module('cutlass.'+node_type)
+    NodeTypeName = getattr(NodeType, node_type)
+    return getattr(NodeTypeName, osdf_json_loaders[node_type])
+
+def search_key(value, search_field):
+    """format_query of a node's search_field value, e.g. unicode from OSDF
+       json, as formatted for the internal id (a utf-8 str) it matches
+    """
+    if isinstance(value, type(u'')):
+        value = value.encode('utf-8')
+    elif not isinstance(value, str):
+        value = str(value)
+    return format_query(value, field=search_field)
+
+def _kept_node(nodes, key, NodeTypeName, load_json=None):
+    """node kept in dict nodes for key, keeping a new one if none: a found
+       node (loaded by load_json if still OSDF json), or a new node since
+       saved.  A new node never saved (e.g. its record failed validation) is
+       replaced, so its changes are not carried to the next record.
+    """
+    node = nodes.get(key)
+    if isinstance(node, dict):
+        node = nodes[key] = load_json(node)
+        log.debug('found node: %s', key)
+    elif node is None or not node.id:
+        node = nodes[key] = NodeTypeName()
+    return node
+
+# (node_type, search_field) -> {format_query(search value): node}
+_prefetched = {}
+_prefetch_lock = threading.Lock()
+# as _prefetched, of every node returned by load_node(s) searches this run
+_searched = {}
+
+def prefetch_nodes(node_type, search_field):
+    """OSDF json of every node of node_type, from one paged query, indexed
+       by its formatted search_field value, for load_node to use instead of
+       one search per record.  All nodes of the type are fetched, not only
+       the study's, as not all node modules tag their nodes with the study.
+    """
+    NodeType = importlib.import_module('cutlass.'+node_type)
+    NodeTypeName = getattr(NodeType, node_type)
+    osdf_type = osdf_node_types.get(node_type, node_type.lower())
+
+    query = '("{}"[node_type])'.format(osdf_type)
+    session = cutlass.iHMPSession.get_session()
+    results = session.get_osdf().oql_query_all_pages(
+            NodeTypeName.namespace, query)['results']
+
+    nodes = {}
+    for result in results:
+        if result['node_type'] != osdf_type:
+            continue
+        value = result['meta'].get(search_field)
+        if not value:
+            continue
+        nodes.setdefault(search_key(value, search_field), result)
+    log.info('Prefetched %s %s nodes (of %s results) by %s',
+             len(nodes), osdf_type, len(results), search_field)
+    return nodes
+
+def clear_prefetched():
+    """drop all prefetched and searched nodes, e.g. after changes made
+       outside this run
+    """
+    with _prefetch_lock:
+        _prefetched.clear()
+        _searched.clear()
+
+def cache_searched(nodes, search_field, node_type):
+    """keep loaded nodes found by a search, by their search_field, for
+       later load_node calls to find without searching; of nodes with the
+       same search value, the first kept stays
+    """
+    with _prefetch_lock:
+        searched = _searched.setdefault((node_type, search_field), {})
+        for node in nodes:
+            value = getattr(node, search_field, None)
+            if value:
+                searched.setdefault(search_key(value, search_field), node)
+
+def load_prefetched_node(internal_id, search_field, node_type):
+    """resolve node from prefetched nodes (prefetching on first use),
+       else create new.  The node returned is kept for the rest of the run, so
+       a repeated internal_id gets the same node, once it is saved.
+    """
+    NodeType = importlib.import_module('cutlass.'+node_type)
+    NodeTypeName = getattr(NodeType, node_type)
+
+    key = search_key(internal_id, search_field)
+    with _prefetch_lock:
+        nodes = _prefetched.get((node_type, search_field))
+        if nodes is None:
+            nodes = prefetch_nodes(node_type, search_field)
+            _prefetched[(node_type, search_field)] = nodes
+        return _kept_node(nodes, key, NodeTypeName, json_loader(node_type))
+
+
+def lookup_chunks(queries, max_clauses=None):
+    """group formatted queries into lists whose OR-combined query stays
+       within max_clauses terms (default: settings.query.lookup_clauses)
+    """
+    max_clauses = max_clauses or settings.query.lookup_clauses
+    chunk, clauses = [], 0
+    for query in queries:
+        terms = max(query.count('['), 1)
+        if chunk and clauses + terms > max_clauses:
+            yield chunk
+            chunk, clauses = [], 0
+        chunk.append(query)
+        clauses += terms
+    if chunk:
+        yield chunk
+
+def load_nodes(internal_ids, search_field, node_type, max_clauses=None):
+    """search and load the nodes of many internal_ids at once, as load_node
+       does for one, with a few OR-combined queries rather than one per id;
+       return dict of internal_id: node, else new node if none matched.
+       The nodes found, and the ids none matched, are kept for load_node to
+       answer those ids without a search.
+    """
+    NodeType = importlib.import_module('cutlass.'+node_type)
+    NodeTypeName = getattr(NodeType, node_type)
+    load_json = json_loader(node_type)
+    osdf_type = osdf_node_types.get(node_type, node_type.lower())
+
+    # formatted query of each id: ids with it
+    ids_by_query = {}
+    for internal_id in internal_ids:
+        query = search_key(internal_id, search_field)
+        ids_by_query.setdefault(query, []).append(internal_id)
+
+    with _prefetch_lock:
+        searched = _searched.setdefault((node_type, search_field), {})
+        to_search = sorted(query for query in ids_by_query
+                           if query not in searched)
+
+    found = {}
+    osdf = cutlass.iHMPSession.get_session().get_osdf()
+    for chunk in lookup_chunks(to_search, max_clauses):
+        query = ' || '.join(chunk)
+        results = osdf.oql_query_all_pages(NodeTypeName.namespace,
+                                           query)['results']
+        for result in results:
+            if result['node_type'] != osdf_type:
+                continue
+            value = result['meta'].get(search_field)
+            if not value:
+                continue
+            # only exact matches, as in load_node
+            key = search_key(value, search_field)
+            if key in ids_by_query:
+                found.setdefault(key, result)
+        log.debug('Looked up %s %s ids: %s results', len(chunk), osdf_type,
+                  len(results))
+    log.info('Found %s of %s %s nodes by %s', len(found), len(to_search),
+             osdf_type, search_field)
+
+    nodes = {}
+    with _prefetch_lock:
+        for query in to_search:
+            searched.setdefault(query, found.get(query))
+        for query, ids in ids_by_query.items():
+            node = _kept_node(searched, query, NodeTypeName, load_json)
+            for internal_id in ids:
+                nodes[internal_id] = node
+    return nodes
+
 
 #TODO: mod node calls to cutlass_utils.load_node; do not need node_load_func
 # node = load_node(internal_id, load_search_field, node_type)
 
 def load_node(internal_id, search_field, node_type, node_load_func):
     """search and load nodes, as specified in arguments, else create new"""
+    if settings.submission.prefetch:
+        return load_prefetched_node(internal_id, search_field, node_type)
+
     # node-specific variables:
     NodeType = importlib.import_module('cutlass.'+node_type)
     NodeTypeName = getattr(NodeType, node_type)
@@ -270,14 +1081,28 @@ def load_node(internal_id, search_field, node_type, node_load_func):
     log.info('In load(%s, %s) using node(%s, %s)',
              internal_id, search_field, NodeTypeName, NodeLoadFunc)
 
+    query = format_query(internal_id, field=search_field)
+    with _prefetch_lock:
+        searched = _searched.get((node_type, search_field), {})
+        if query in searched:
+            log.debug('found searched node: %s', query)
+            return _kept_node(searched, query, NodeTypeName,
+                              json_loader(node_type))
+
     try:
-        query = format_query(internal_id, field=search_field)
-        results = NodeSearch(query)
+        results = list(NodeSearch(query))
         log.debug('results: %s', results)
+        if settings.submission.search_cache:
+            # keep every node returned, so a repeated or sibling id is
+            # answered without a search; the new node of an unmatched id is
+            # handed out again only once saved (see _kept_node)
+            cache_searched(results, search_field, node_type)
+            with _prefetch_lock:
+                return _kept_node(_searched[(node_type, search_field)],
+                                  query, NodeTypeName)
         for node in results:
             getattr_search_field = \
-                    format_query(getattr(node, search_field),
-                                 field=search_field)
+                    search_key(getattr(node, search_field), search_field)
             # log.debug('getattr: %s', getattr(node, search_field))
             log.debug('getattr: %s', getattr_search_field)
             # if internal_id == getattr(node, search_field):
@@ -28,6 +28,9 @@ import csv
 import logging
 import time
 
+from checksum_utils import file_checksums, checksum_files, ChecksumCache
+from dir_utils import DirIndex
+
 """Subprocess module wrappers"""
 from subprocess import call, check_output
 from subprocess import STDOUT
@@ -106,24 +109,19 @@ def write_out_csv(csv_file,fieldnames,values=[]):
         raise e
 
 def checksums(filename):
-    """run md5 and sha256 checksums, return strings of two digests"""
+    """md5 and sha256 checksums in one read, return strings of two digests"""
     log.info('Running checksums on: '+filename)
 
-    md5_cmd = ' '.join(['md5sum', filename])
-    md5_out = get_output(md5_cmd, stderr=None)
-    md5_str = re.split(' ', md5_out)[0]
+    (md5_str, sha256_str) = file_checksums(filename)
     log.debug('checksum md5: '+md5_str)
-
-    sha256_cmd = ' '.join(['sha256sum', filename])
-    sha256_out = get_output(sha256_cmd, stderr=None)
-    sha256_str = re.split(' ', sha256_out)[0]
     log.debug('checksum sha: '+sha256_str)
 
     return (md5_str, sha256_str)
 
-def write_checksum_list(file_name, checksum_file):
+def write_checksum_list(file_name, checksum_file, digests=None):
     """generate list of file_name, md5sum and sha256sum
        then write file_name, file_size, md5sum, sha256sum values to csv outfile
+       digests: (md5, sha256) if already computed, else checksums() are run
     """
     log.info( '-> Beginning function %s', 'write_checksum_list')
     fields = ['local_file','size','format','md5','sha256']
@@ -133,7 +131,7 @@ def write_checksum_list(file_name, checksum_file):
         # log.debug( '-> Beginning try with: %s', file_name)
         if os.path.exists(file_name) and os.path.getsize(file_name) >= 0:
             # log.debug('checksums for file being created: %s', file_name)
-            (md5_str, sha_str) = checksums(file_name)
+            (md5_str, sha_str) = digests or checksums(file_name)
             log.info('checksums for file created: %s', file_name)
             file_size = os.stat(file_name).st_size
             file_path = os.path.abspath(file_name)
@@ -168,27 +166,37 @@ def dir_checksum(args):
     checksummed = 0
     errored = 0
     errfiles = []
+    file_paths = []
     try:
         subdirs = ['raw', 'clean']
         for subdir in subdirs:
             subpath = os.path.join(data_path, subdir)
             log.debug('subpath:', subpath)
-            try:
-                for file in os.listdir(subpath):
-                    # log.debug('file in dir: %s', file)
-                    file_path = os.path.join(subpath, file)
-                    log.debug('file path: %s', file_path)
-                    write_checksum_list(file_path, checksum_file)
-                    checksummed += 1
-            except Exception as e:
-                log.error('Error in "%s"!!!   %s', 'file_in_subpath', e)
-                errored += 1
-                errfiles.append(file)
-                raise e
+            for file in os.listdir(subpath):
+                file_path = os.path.join(subpath, file)
+                log.debug('file path: %s', file_path)
+                file_paths.append(file_path)
     except Exception, e:
         log.error('Error in "%s"!!!   %s', 'convert_and_checksum', e)
         # continue to next, instead of `raise e`
 
+    # checksum all files at once, each in a single read,
+    # except those unchanged since cached by an earlier run:
+    processes = getattr(args, 'checksum_processes', None)
+    cache = ChecksumCache.for_checksum_list(checksum_file)
+    try:
+        for file_path, digests, error in checksum_files(file_paths, processes,
+                                                        cache):
+            if error:
+                log.error('Error in "%s"!!!   %s', 'file_in_subpath', error)
+                errored += 1
+                errfiles.append(os.path.basename(file_path))
+                continue
+            write_checksum_list(file_path, checksum_file, digests)
+            checksummed += 1
+    finally:
+        cache.close()
+
     # summarize:
     log.info( '-> Files compression checksummed: %4s', str(checksummed))
     log.error('-> Errors found when processing:  %4s', str(errored))
@@ -198,11 +206,9 @@ def dir_checksum(args):
         log.error('Files: %s', str(errfiles))
 
 def rename_files(args):
-    """loop through mapping_file, subloop through files in curdir+row-subdir,
-       rename matching filenames, convert compression formats, log
-       checksums and file name/size to checksum_file
+    """loop through mapping_file, matching files in each row-subdir (listed
+       once per subdir), plan the renames of all matches, then move them
     """
-    #TODO: squeeze into single loop through map_file, search curdir for match
 
     map_file = args.mapping_file
     checksum_file = args.checksum_list_file
@@ -217,6 +223,9 @@ def rename_files(args):
         pending = 0
         pending_files = []
 
+    plan = []       # (srce, file, repl_file) of each move, once all planned
+    planned = set() # files already in plan; each moves once
+    dirs = {}       # filepath: DirIndex, listed once per dir
     for row in yield_csv_data(map_file):
         if row['original_file_base'] and row['dcc_file_base']: #row isn't empty
             # dir = row['dir']
@@ -228,43 +237,49 @@ def rename_files(args):
             try:
                 filepath = os.path.join(data_path, row['dir'])
                 # log.debug('__ filepath='+filepath)
-                for file in os.listdir(filepath):
+                if filepath not in dirs:
+                    dirs[filepath] = DirIndex(filepath)
+                for file in dirs[filepath].match(srce):
                     # log.debug('__ file=%s, %s', file, row['dir'])
-                    if re.match(srce, file):
-                        repl_sub = re.sub(srce, dest, file)
-                        repl_path = os.path.join(data_path, renamed_path, row['dir'])
-                        repl_file = os.path.join(repl_path, repl_sub)
-                        file = os.path.join(filepath, file)
-                        log.info('Moving "%s" to "%s"', file, repl_file)
-                        try:
-                            os.renames(file, repl_file)
-                            try:
-                                #TODO: check is_symlink before .st_size? (only if on same host)
-                                if int(os.stat(repl_file).st_size) > 0:
-                                    pass
-                                    # os.chmod(repl_file, 0444) # not needed for links, only for new files
-                                else:
-                                    log.error('Error in "%s"!!! file: %s, except: %s',
-                                              'file.stat', file, e)
-
-                            except Exception, e:
-                                log.error('Error in "%s"!!! file: %s, except: %s',
-                                          'rename_files.stat+chmod', file, e)
-                                # raise e
-                        except Exception, e:
-                            log.error('Error in "%s"!!! file: %s, except: %s',
-                                      'rename_files.os-renames', file, e)
-                            summary.errored += 1
-                            summary.errfiles.append(srce)
-                            # raise e
-
-
+                    file = os.path.join(filepath, file)
+                    if file in planned:
+                        continue
+                    planned.add(file)
+                    repl_sub = re.sub(srce, dest, os.path.basename(file))
+                    repl_path = os.path.join(data_path, renamed_path, row['dir'])
+                    repl_file = os.path.join(repl_path, repl_sub)
+                    plan.append((srce, file, repl_file))
             except Exception as e:
                 log.error('Error in "%s"!!! row: %s, except: %s', 'rename_files', row, e)
                 summary.errored += 1
                 summary.errfiles.append(srce)
                 # continue to next, instead of `raise e`
 
+    log.info('Renaming %s files', len(plan))
+    for srce, file, repl_file in plan:
+        log.info('Moving "%s" to "%s"', file, repl_file)
+        try:
+            os.renames(file, repl_file)
+            try:
+                #TODO: check is_symlink before .st_size? (only if on same host)
+                if int(os.stat(repl_file).st_size) > 0:
+                    pass
+                    # os.chmod(repl_file, 0444) # not needed for links, only for new files
+                else:
+                    log.error('Error in "%s"!!! file: %s, except: %s',
+                              'file.stat', file, e)
+
+            except Exception, e:
+                log.error('Error in "%s"!!! file: %s, except: %s',
+                          'rename_files.stat+chmod', file, e)
+                # raise e
+        except Exception, e:
+            log.error('Error in "%s"!!! file: %s, except: %s',
+                      'rename_files.os-renames', file, e)
+            summary.errored += 1
+            summary.errfiles.append(srce)
+            # raise e
+
     # summarize:
     log.info('-> Files successfully renamed:   %4s', str(summary.renamed))
     # log.info('-> Files compression converted:  %4s', str(summary.converted))
@@ -291,6 +306,7 @@ if __name__ == '__main__':
         # data_path = '/Volumes/helix_weinstock/projects/HMP2/submissions/data/'
         data_path = '/data/weinstocklab/projects/HMP2/submissions/data/'
         renamed_path = 'renamed'
+        checksum_processes = None # files checksummed at once; None: per cpu
 
 
     # ...[ 16S ]...
@@ -26,6 +26,11 @@ import logging
 import time
 import shutil
 
+from checksum_utils import file_checksums, checksum_files, ChecksumCache
+from archive_utils import prefix_tar, run_pooled
+from join_utils import LibraryRunIndex
+from dir_utils import DirIndex
+
 """Subprocess module wrappers"""
 from subprocess import call, check_output
 from subprocess import STDOUT
@@ -126,42 +131,22 @@ def write_out_csv(csv_file,fieldnames,values=[]):
         raise e
 
 def checksums(filename):
-    """run md5 and sha256 checksums, return strings of two digests"""
+    """md5 and sha256 checksums in one read, return strings of two digests"""
     log.info('Running checksums on: '+filename)
 
-    md5_cmd = ' '.join(['md5sum', filename])
-    md5_out = get_output(md5_cmd, stderr=None)
-    md5_str = re.split(' ', md5_out)[0]
+    (md5_str, sha256_str) = file_checksums(filename)
     log.debug('checksum md5: '+md5_str)
-
-    sha256_cmd = ' '.join(['sha256sum', filename])
-    sha256_out = get_output(sha256_cmd, stderr=None)
-    sha256_str = re.split(' ', sha256_out)[0]
     log.debug('checksum sha: '+sha256_str)
 
     return (md5_str, sha256_str)
 
 def generate_raw_tar(dest_path="./", file_prefix=""):
-    """generate tar archives, return file name"""
+    """generate tar archive of files named file_prefix*, return file name"""
     try:
-        src_path = os.path.dirname(file_prefix)
-        prefix = os.path.basename(file_prefix)
-        os.chdir(src_path)
-        # try:
-            # statinfo = os.lstat(file_prefix+'*')
-            # # log.debug(statinfo)
-        # except Exception, e:
-            # log.info("Prefix '%s' files do not exist!", file_prefix)
-            # return None
-        # else:
-            # tar_file = os.path.join(dest_path, file_prefix + '.raw.fastq.tar')
-            # tar_cmd = ' '.join(['tar', 'chf', tar_file, prefix+'*'])
-            # tar_stat = get_output(tar_cmd)
-            # log.info('Archive file created: %s', tar_file)
-            # return tar_file
-        tar_file = os.path.join(dest_path, file_prefix + '.raw.fastq.tar')
-        tar_cmd = ' '.join(['tar', 'chf', tar_file, prefix+'*'])
-        tar_stat = get_output(tar_cmd)
+        tar_file = os.path.join(dest_path,
+                                os.path.basename(file_prefix) + '.raw.fastq.tar')
+        prefix_tar(tar_file, file_prefix)
+
         log.info('Archive file created: %s', tar_file)
         return tar_file
 
@@ -169,9 +154,10 @@ def generate_raw_tar(dest_path="./", file_prefix=""):
         log.error('Uh-Oh (generate_raw_tar)... %s', e)
         raise e
 
-def write_checksum_list(file_name, checksum_file):
+def write_checksum_list(file_name, checksum_file, digests=None):
     """generate list of file_name, md5sum and sha256sum
        then write file_name, file_size, md5sum, sha256sum values to csv outfile
+       digests: (md5, sha256) if already computed, else checksums() are run
     """
     log.info( '-> Beginning function %s', 'write_checksum_list')
     fields = ['local_file','size','format','md5','sha256']
@@ -181,7 +167,7 @@ def write_checksum_list(file_name, checksum_file):
         # log.debug( '-> Beginning try with: %s', file_name)
         if os.path.exists(file_name) and os.path.getsize(file_name) >= 0:
             # log.debug('checksums for file being created: %s', file_name)
-            (md5_str, sha_str) = checksums(file_name)
+            (md5_str, sha_str) = digests or checksums(file_name)
             log.info('checksums for file created: %s', file_name)
             file_size = os.stat(file_name).st_size
             file_path = os.path.abspath(file_name)
@@ -218,28 +204,38 @@ def dir_checksum(args, subdirs = ['raw', 'clean']):
     checksummed = 0
     errored = 0
     errfiles = []
+    file_paths = []
     try:
         for subdir in subdirs:
             subpath = os.path.join(data_path, subdir)
             log.debug('subpath: %s', subpath)
-            try:
-                for file in os.listdir(subpath):
-                    if subdir == 'raw' and not file.endswith('tar'):
-                        next
-                    # log.debug('file in dir: %s', file)
-                    file_path = os.path.join(subpath, file)
-                    log.debug('file path: %s', file_path)
-                    write_checksum_list(file_path, checksum_file)
-                    checksummed += 1
-            except Exception as e:
-                log.error('Error in "%s"!!!   %s', 'file_in_subpath', e)
-                errored += 1
-                errfiles.append(file)
-                raise e
+            for file in os.listdir(subpath):
+                if subdir == 'raw' and not file.endswith('tar'):
+                    next
+                file_path = os.path.join(subpath, file)
+                log.debug('file path: %s', file_path)
+                file_paths.append(file_path)
     except Exception, e:
         log.error('Error in "%s"!!!   %s', 'dir_checksum', e)
         # continue to next, instead of `raise e`
 
+    # checksum all files at once, each in a single read,
+    # except those unchanged since cached by an earlier run:
+    processes = getattr(args, 'checksum_processes', None)
+    cache = ChecksumCache.for_checksum_list(checksum_file)
+    try:
+        for file_path, digests, error in checksum_files(file_paths, processes,
+                                                        cache):
+            if error:
+                log.error('Error in "%s"!!!   %s', 'file_in_subpath', error)
+                errored += 1
+                errfiles.append(os.path.basename(file_path))
+                continue
+            write_checksum_list(file_path, checksum_file, digests)
+            checksummed += 1
+    finally:
+        cache.close()
+
     # summarize:
     log.info( '-> Files compression checksummed: %4s', str(checksummed))
     log.error('-> Errors found when processing:  %4s', str(errored))
@@ -258,41 +254,47 @@ def archive_raw_fastq_files(args):
     archived = 0
     errored = 0
     errfiles = []
+    archives = [] # (file_path, prefix, dest) of each archive to build
     for row in yield_csv_data(map_file):
         if (re.search('raw', row['dir']) and
                 row['dcc_file_base'] != ''):
             dest = row['dcc_file_base']
             dir = row['dir']
             # dir = 'raw'
-            try:
-                file_path = os.path.join(data_path, dir)
-                # log.debug('(%s)... file_path: %s', 'archive', file_path)
-                pref = os.path.join(file_path, dest)
-                # log.debug('(%s)... file_path_pref: %s', 'archive', pref)
-                tar_file = generate_raw_tar(file_path, file_prefix=pref)
-                # archived += 1 #debug "+= 1" syntax errors
-
-            except Exception, e:
-                log.error('Error in "%s"!!!   %s', 'archive_raw_fastq_files', e)
-                # errored += 1 #debug "+= 1" syntax errors
-                errfiles.append(dest)
-                # continue to next, instead of `raise e`
+            file_path = os.path.join(data_path, dir)
+            # log.debug('(%s)... file_path: %s', 'archive', file_path)
+            pref = os.path.join(file_path, dest)
+            # log.debug('(%s)... file_path_pref: %s', 'archive', pref)
+            archives.append((file_path, pref, dest))
+
+    # build archives at once, on `args.archive_workers` threads:
+    def archive(job):
+        (file_path, pref, dest) = job
+        return generate_raw_tar(file_path, file_prefix=pref)
+
+    workers = getattr(args, 'archive_workers', None)
+    for (file_path, pref, dest), tar_file, e in run_pooled(archive, archives,
+                                                           workers):
+        if e:
+            log.error('Error in "%s"!!!   %s', 'archive_raw_fastq_files', e)
+            errored += 1
+            errfiles.append(dest)
+            # continue to next, instead of `raise e`
+        else:
+            archived += 1
 
     # summarize:
     log.info( '-> Files successfully archived: %4s', str(archived))
     log.error('-> Errors found when moving:    %4s', str(errored))
-    # if errored:
-    if True: #debug "+= 1" syntax errors
+    if errored:
         log.error('  -> For specifics on these files that errored, '
                   'please see the logfile.')
         log.error('Files: %s', str(errfiles))
 
 def rename_files(args):
-    """loop through mapping_file, subloop through files in curdir+row-subdir,
-       rename matching filenames, convert compression formats, log
-       checksums and file name/size to checksum_file
+    """loop through mapping_file, matching files in each row-subdir (listed
+       once per subdir), plan the renames of all matches, then move them
     """
-    #TODO: squeeze into single loop through map_file, search curdir for match
 
     map_file = args.mapping_file
     checksum_file = args.checksum_list_file
@@ -307,6 +309,9 @@ def rename_files(args):
         pending = 0
         pending_files = []
 
+    plan = []       # (srce, file, repl_file) of each move, once all planned
+    planned = set() # files already in plan; each moves once
+    dirs = {}       # filepath: DirIndex, listed once per dir
     for row in yield_csv_data(map_file):
         if row['original_file_base'] and row['dcc_file_base']: #row isn't empty
             srce = row['second_file_base'] \
@@ -317,36 +322,19 @@ def rename_files(args):
             try:
                 filepath = os.path.join(data_path, row['dir'])
                 # log.debug('__ filepath='+filepath)
-                for file in os.listdir(filepath):
+                if filepath not in dirs:
+                    dirs[filepath] = DirIndex(filepath)
+                for file in dirs[filepath].match(srce):
                     # log.debug('__ file=%s, %s', file, row['dir'])
-                    if re.match(srce, file):
-                        repl_sub = re.sub(srce, dest, file)
-                        # repl_path = os.path.join(data_path, row['dir'])
-                        repl_path = os.path.join(data_path, renamed_path, os.path.basename(row['dir']))
-                        repl_file = os.path.join(repl_path, repl_sub)
-                        file = os.path.join(filepath, file)
-                        log.info('Copying "%s" to "%s"', file, repl_file)
-                        try:
-                            # copy(file, repl_file)
-                            move(file, repl_file)
-                            try:
-                                #TODO: check is_symlink before .st_size? (only if on same host)
-                                if int(os.lstat(repl_file).st_size) > 0:
-                                    summary.renamed += 1
-                                    # os.chmod(repl_file, 0444) # not needed for links, only for new files
-                                else:
-                                    log.error('Error in "%s"!!! file: %s, except: %s',
-                                              'file.stat', file, e)
-                            except Exception, e:
-                                log.error('Error in "%s"!!! file: %s, except: %s',
-                                          'rename_files.stat+chmod', file, e)
-                                # raise e
-                        except Exception, e:
-                            log.error('Error in "%s"!!! file: %s, except: %s',
-                                      'rename_files.os-renames', file, e)
-                            summary.errored += 1
-                            summary.errfiles.append(srce)
-                            # raise e
+                    file = os.path.join(filepath, file)
+                    if file in planned:
+                        continue
+                    planned.add(file)
+                    repl_sub = re.sub(srce, dest, os.path.basename(file))
+                    # repl_path = os.path.join(data_path, row['dir'])
+                    repl_path = os.path.join(data_path, renamed_path, os.path.basename(row['dir']))
+                    repl_file = os.path.join(repl_path, repl_sub)
+                    plan.append((srce, file, repl_file))
             except Exception as e:
                 log.error('Error in "%s"!!! row: %s, except: %s', 'rename_files', row, e)
                 summary.errored += 1
@@ -355,6 +343,31 @@ def rename_files(args):
         else:
             summary.pending += 1
 
+    log.info('Renaming %s files', len(plan))
+    for srce, file, repl_file in plan:
+        log.info('Copying "%s" to "%s"', file, repl_file)
+        try:
+            # copy(file, repl_file)
+            move(file, repl_file)
+            try:
+                #TODO: check is_symlink before .st_size? (only if on same host)
+                if int(os.lstat(repl_file).st_size) > 0:
+                    summary.renamed += 1
+                    # os.chmod(repl_file, 0444) # not needed for links, only for new files
+                else:
+                    log.error('Error in "%s"!!! file: %s, except: %s',
+                              'file.stat', file, e)
+            except Exception, e:
+                log.error('Error in "%s"!!! file: %s, except: %s',
+                          'rename_files.stat+chmod', file, e)
+                # raise e
+        except Exception, e:
+            log.error('Error in "%s"!!! file: %s, except: %s',
+                      'rename_files.os-renames', file, e)
+            summary.errored += 1
+            summary.errfiles.append(srce)
+            # raise e
+
     # summarize:
     log.info('-> Files successfully renamed:   %4s', str(summary.renamed))
     # log.info('-> Files compression converted:  %4s', str(summary.converted))
@@ -380,20 +393,33 @@ def create_mapping_file(args):
               'final_sample_name', 'rand_subject_id', 'flag_meanings']
     write_out_csv(map_outfile, fields) # headers to outfiles
 
-    preps = [row for row in yield_csv_data(prep_file)]
+    # preps by jaxid_library; matched to each file base's library and run id
+    preps = LibraryRunIndex(yield_csv_data(prep_file))
+    unmatched = []
+    ambiguous = []
     for maprow in yield_csv_data(map_file):
         srce_file = maprow['second_file_base'] \
             if maprow['second_file_base'] != '' \
             else maprow['original_file_base']
-        for prep in preps:
-            libid = prep['jaxid_library']
-            runid = prep['run_id']
-            if libid:
-                # log.debug('jaxid_library: %s', libid)
-                if re.search(libid,srce_file) and re.search(runid,srce_file):
-                    maprow['dcc_file_base'] = prep['prep_id']
+        prep_ids = [prep['prep_id'] for prep in preps.matches(srce_file)]
+        if prep_ids:
+            # last matching prep, as listed in prep_file
+            maprow['dcc_file_base'] = prep_ids[-1]
+            if len(set(prep_ids)) > 1:
+                log.warn('Multiple preps match %s: %s', srce_file, prep_ids)
+                ambiguous.append(srce_file)
+        else:
+            unmatched.append(srce_file)
         write_out_csv(map_outfile, fields, [maprow])
 
+    # summarize:
+    log.info('-> Files without matching prep:   %4s', str(len(unmatched)))
+    if unmatched:
+        log.error('  -> Files: %s', str(unmatched))
+    log.info('-> Files matching several preps: %4s', str(len(ambiguous)))
+    if ambiguous:
+        log.error('  -> Files: %s', str(ambiguous))
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Make it Happen' ~~~~~
 
 if __name__ == '__main__':
@@ -406,6 +432,8 @@ if __name__ == '__main__':
         base_path = '/projects/weinstock-lab/projects/HMP2_iHMP_Snyder/submissions/dcc_osdf/submit_osdf/data_files/'
         data_path = '/projects/weinstock-lab/projects/HMP2_iHMP_Snyder/submissions/data/'
         renamed_path = 'renamed'
+        checksum_processes = None # files checksummed at once; None: per cpu
+        archive_workers = None # archives built at once; None: per cpu
 
     # ...[ 16S ]...
     args.checksum_list_file = args.data_path + 'checksums/20170619_raw_clean_16S_checksums_latest.csv'
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Directory listings read once and indexed, for the file renaming scripts
+   (dcc_submission_file_name_change.py, etc) to find the files matching
+   each mapping row without listing the directory again per row.
+"""
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Imports ~~~~~
+import os
+import re
+from bisect import bisect_left
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Constants ~~~~~
+REGEX_SPECIALS = '.^$*+?{}[]\\|()'
+REGEX_REPEATS = '*?{'
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Functional ~~~~~
+
+def literal_prefix(pattern):
+    """leading literal text every re.match of pattern must start with"""
+    if '|' in pattern:
+        return ''
+    prefix = []
+    for char in pattern:
+        if char in REGEX_SPECIALS:
+            # a repeat makes the char before it optional
+            if char in REGEX_REPEATS and prefix:
+                prefix.pop()
+            break
+        prefix.append(char)
+    return ''.join(prefix)
+
+
+class DirIndex(object):
+    """Names in directory `path`, listed once and sorted"""
+
+    def __init__(self, path):
+        self.path = path
+        self.names = sorted(os.listdir(path))
+
+    def match(self, pattern):
+        """names that re.match(pattern, name), found by bisecting to the
+           pattern's literal prefix rather than trying every name
+        """
+        prefix = literal_prefix(pattern)
+        regex = re.compile(pattern)
+        matched = []
+        pos = bisect_left(self.names, prefix)
+        while pos < len(self.names) and self.names[pos].startswith(prefix):
+            if regex.match(self.names[pos]):
+                matched.append(self.names[pos])
+            pos += 1
+        return matched
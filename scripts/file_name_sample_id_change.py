@@ -26,6 +26,10 @@ import logging
 import time
 import shutil
 
+from checksum_utils import file_checksums, checksum_files, ChecksumCache
+from archive_utils import prefix_tar, run_pooled
+from join_utils import LibraryRunIndex
+
 """Subprocess module wrappers"""
 from subprocess import call, check_output
 from subprocess import STDOUT #, STD_ERROR_HANDLE as STDERR
@@ -108,30 +112,21 @@ def write_out_csv(csv_file,fieldnames,values=[]):
         raise e
 
 def checksums(filename):
-    """run md5 and sha256 checksums, return strings of two digests"""
+    """md5 and sha256 checksums in one read, return strings of two digests"""
     log.info('Running checksums on: '+filename)
 
-    md5_cmd = ' '.join(['md5sum', filename])
-    md5_out = get_output(md5_cmd, stderr=None)
-    md5_str = re.split(' ', md5_out)[0]
+    (md5_str, sha256_str) = file_checksums(filename)
     log.debug('checksum md5: '+md5_str)
-
-    sha256_cmd = ' '.join(['sha256sum', filename])
-    sha256_out = get_output(sha256_cmd, stderr=None)
-    sha256_str = re.split(' ', sha256_out)[0]
     log.debug('checksum sha: '+sha256_str)
 
     return (md5_str, sha256_str)
 
 def generate_raw_tar(dest_path="./", file_prefix=""):
-    """generate tar archives, return file name"""
+    """generate tar archive of files named file_prefix*, return file name"""
     try:
-        src_path = os.path.dirname(file_prefix)
-        prefix = os.path.basename(file_prefix)
-        os.chdir(src_path)
-        tar_file = os.path.join(dest_path, file_prefix + '.raw.fastq.tar')
-        tar_cmd = ' '.join(['tar', 'chf', tar_file, prefix+'*'])
-        tar_stat = get_output(tar_cmd)
+        tar_file = os.path.join(dest_path,
+                                os.path.basename(file_prefix) + '.raw.fastq.tar')
+        prefix_tar(tar_file, file_prefix)
 
         log.info('Archive file created: %s', tar_file)
         return tar_file
@@ -140,9 +135,10 @@ def generate_raw_tar(dest_path="./", file_prefix=""):
         log.error('Uh-Oh (generate_raw_tar)... %s', e)
         raise e
 
-def write_checksum_list(file_name, checksum_file):
+def write_checksum_list(file_name, checksum_file, digests=None):
     """generate list of file_name, md5sum and sha256sum
        then write file_name, file_size, md5sum, sha256sum values to csv outfile
+       digests: (md5, sha256) if already computed, else checksums() are run
     """
     log.info( '-> Beginning function %s', 'write_checksum_list')
     fields = ['local_file','size','format','md5','sha256']
@@ -152,7 +148,7 @@ def write_checksum_list(file_name, checksum_file):
         # log.debug( '-> Beginning try with: %s', file_name)
         if os.path.exists(file_name) and os.path.getsize(file_name) >= 0:
             # log.debug('checksums for file being created: %s', file_name)
-            (md5_str, sha_str) = checksums(file_name)
+            (md5_str, sha_str) = digests or checksums(file_name)
             log.info('checksums for file created: %s', file_name)
             file_size = os.stat(file_name).st_size
             file_path = os.path.abspath(file_name)
@@ -187,28 +183,37 @@ def dir_checksum(args):
     checksummed = 0
     errored = 0
     errfiles = []
+    file_paths = []
     try:
         subdirs = ['raw', 'clean']
         for subdir in subdirs:
             subpath = os.path.join(data_path, subdir)
             log.debug('subpath:', subpath)
-            try:
-                for file in os.listdir(subpath):
-                    # log.debug('file in dir: %s', file)
-                    # write_checksum_list(os.path.abspath(file), checksum_file)
-                    file_path = os.path.join(subpath, file)
-                    log.debug('file path: %s', file_path)
-                    write_checksum_list(file_path, checksum_file)
-                    checksummed += 1
-            except Exception as e:
-                log.error('Error in "%s"!!!   %s', 'file_in_subpath', e)
-                errored += 1
-                errfiles.append(file)
-                raise e
+            for file in os.listdir(subpath):
+                file_path = os.path.join(subpath, file)
+                log.debug('file path: %s', file_path)
+                file_paths.append(file_path)
     except Exception, e:
         log.error('Error in "%s"!!!   %s', 'convert_and_checksum', e)
         # continue to next, instead of `raise e`
 
+    # checksum all files at once, each in a single read,
+    # except those unchanged since cached by an earlier run:
+    processes = getattr(args, 'checksum_processes', None)
+    cache = ChecksumCache.for_checksum_list(checksum_file)
+    try:
+        for file_path, digests, error in checksum_files(file_paths, processes,
+                                                        cache):
+            if error:
+                log.error('Error in "%s"!!!   %s', 'file_in_subpath', error)
+                errored += 1
+                errfiles.append(os.path.basename(file_path))
+                continue
+            write_checksum_list(file_path, checksum_file, digests)
+            checksummed += 1
+    finally:
+        cache.close()
+
     # summarize:
     log.info( '-> Files compression checksummed: %4s', str(checksummed))
     log.error('-> Errors found when processing:  %4s', str(errored))
@@ -228,28 +233,36 @@ def archive_raw_fastq_files(args):
     archived = 0
     errored = 0
     errfiles = []
+    archives = [] # (file_path, prefix, dest) of each archive to build
     for old, new in filename_changes.items():
         if new:
             dest = new
             dir = 'raw'
-            try:
-                file_path = os.path.join(data_path, renamed_path, dir)
-                # log.debug('(%s)... file_path: %s', 'archive', file_path)
-                pref = os.path.join(file_path, dest)
-                tar_file = generate_raw_tar(file_path, file_prefix=pref)
-                # archived += 1 #debug "+= 1" syntax errors
-
-            except Exception, e:
-                log.error('Error in "%s"!!!   %s', 'archive_raw_fastq_files', e)
-                # errored += 1 #debug "+= 1" syntax errors
-                errfiles.append(dest)
-                # continue to next, instead of `raise e`
+            file_path = os.path.join(data_path, renamed_path, dir)
+            # log.debug('(%s)... file_path: %s', 'archive', file_path)
+            pref = os.path.join(file_path, dest)
+            archives.append((file_path, pref, dest))
+
+    # build archives at once, on `args.archive_workers` threads:
+    def archive(job):
+        (file_path, pref, dest) = job
+        return generate_raw_tar(file_path, file_prefix=pref)
+
+    workers = getattr(args, 'archive_workers', None)
+    for (file_path, pref, dest), tar_file, e in run_pooled(archive, archives,
+                                                           workers):
+        if e:
+            log.error('Error in "%s"!!!   %s', 'archive_raw_fastq_files', e)
+            errored += 1
+            errfiles.append(dest)
+            # continue to next, instead of `raise e`
+        else:
+            archived += 1
 
     # summarize:
-    # log.info( '-> Files successfully archived: %4s', str(archived))
+    log.info( '-> Files successfully archived: %4s', str(archived))
     log.error('-> Errors found when moving:    %4s', str(errored))
-    # if errored:
-    if True: #debug "+= 1" syntax errors
+    if errored:
         log.error('  -> For specifics on these files that errored, '
                   'please see the logfile.')
         log.error('Files: %s', str(errfiles))
@@ -266,20 +279,33 @@ def create_mapping_file(args):
               'final_sample_name', 'rand_subject_id', 'flag_meanings']
     write_out_csv(map_outfile, fields) # headers to outfiles
 
-    preps = [row for row in yield_csv_data(prep_file)]
+    # preps by jaxid_library; matched to each file base's library and run id
+    preps = LibraryRunIndex(yield_csv_data(prep_file))
+    unmatched = []
+    ambiguous = []
     for maprow in yield_csv_data(map_file):
         srce_file = maprow['second_file_base'] \
             if maprow['second_file_base'] != '' \
             else maprow['original_file_base']
-        for prep in preps:
-            libid = prep['jaxid_library']
-            runid = prep['run_id']
-            if libid:
-                # log.debug('jaxid_library: %s', libid)
-                if re.search(libid,srce_file) and re.search(runid,srce_file):
-                    maprow['dcc_file_base'] = prep['prep_id']
+        prep_ids = [prep['prep_id'] for prep in preps.matches(srce_file)]
+        if prep_ids:
+            # last matching prep, as listed in prep_file
+            maprow['dcc_file_base'] = prep_ids[-1]
+            if len(set(prep_ids)) > 1:
+                log.warn('Multiple preps match %s: %s', srce_file, prep_ids)
+                ambiguous.append(srce_file)
+        else:
+            unmatched.append(srce_file)
         write_out_csv(map_outfile, fields, [maprow])
 
+    # summarize:
+    log.info('-> Files without matching prep:   %4s', str(len(unmatched)))
+    if unmatched:
+        log.error('  -> Files: %s', str(unmatched))
+    log.info('-> Files matching several preps: %4s', str(len(ambiguous)))
+    if ambiguous:
+        log.error('  -> Files: %s', str(ambiguous))
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Make it Happen' ~~~~~
 
 if __name__ == '__main__':
@@ -292,6 +318,8 @@ if __name__ == '__main__':
         base_path = '/data/weinstocklab/projects/HMP2/submissions/dcc_osdf/submit_osdf/data_files/'
         data_path = '/data/weinstocklab/projects/HMP2/submissions/data/'
         renamed_path = 'renamed'
+        checksum_processes = None # files checksummed at once; None: per cpu
+        archive_workers = None # archives built at once; None: per cpu
 
     filename_changes = {
         'HMP2_J09164_1_ST_T0_B0_0120_ZMGT937-04_ADM3N':        'HMP2_J09164_1_NS.*ZMGT937-04_ADM3N',
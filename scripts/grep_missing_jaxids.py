@@ -19,6 +19,8 @@ import logging
 import time
 import shutil
 
+from match_utils import scan_files
+
 """Subprocess module wrappers"""
 from subprocess import call, check_output
 from subprocess import STDOUT #, STD_ERROR_HANDLE as STDERR
@@ -100,6 +102,37 @@ def write_out_csv(csv_file,fieldnames,values=[]):
     except IOError, e:
         raise e
 
+def grep_files(paths):
+    """files to grep: each path, or the files in it if a directory"""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if os.path.isfile(os.path.join(path, name)):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+def print_grep_hits(jaxids, paths, processes=None):
+    """print lines of files in paths containing each jaxid, grouped by jaxid
+       (as 'jaxid,;' then its lines), reading each file once for all ids.
+       Lines are prefixed with their file name when more than one file.
+    """
+    files = list(grep_files(paths))
+    hits = scan_files(jaxids, files, processes)
+    for jaxid, lines in hits.items():
+        if len(files) > 1:
+            lines = [':'.join([filename, line]) for filename, line in lines]
+        else:
+            lines = [line for filename, line in lines]
+        hit = jaxid + ',;' + '\n'.join(lines)
+        if not isinstance(hit, str):
+            # unicode lines (io.open) would not print to a pipe in py2
+            hit = hit.encode('utf-8')
+        print(hit)
+    log.info('Found %s of %s jaxids in %s files',
+             sum(1 for lines in hits.values() if lines), len(hits), len(files))
+    return hits
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Make it Happen' ~~~~~
 
 if __name__ == '__main__':
@@ -112,6 +145,7 @@ if __name__ == '__main__':
         base_path = '/data/weinstocklab/projects/HMP2/submissions/dcc_osdf/submit_osdf/data_files/'
         data_path = '/data/weinstocklab/projects/HMP2/submissions/data/'
         renamed_path = 'renamed'
+        grep_processes = None  # files scanned at once; None: one per cpu
 
     # ...[ 16S ]...
     jaxid_missing_file = 'data_files/20170213_notsubmitted_jaxids-16S.csv'
@@ -130,11 +164,5 @@ if __name__ == '__main__':
     # grep_file = 'data_files/20170202-samples_rnaseq_merged.csv'
     # grep_file = 'logs/'
 
-    for idrow in yield_csv_data(jaxid_missing_file):
-        jaxid = idrow['jaxid']
-        collab_id = idrow['collab_id']
-        grep_cmd = ' '.join(['echo -n', jaxid+",;",
-                             'grep', '"'+jaxid+'"',
-                             grep_file, '; exit 0'])
-        # log.warning(get_output(grep_cmd))
-        print(get_output(grep_cmd))
+    jaxids = [idrow['jaxid'] for idrow in yield_csv_data(jaxid_missing_file)]
+    print_grep_hits(jaxids, [grep_file], args.grep_processes)
@@ -16,6 +16,8 @@ import csv
 import logging
 import time
 
+from match_utils import MultiMatcher
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Constants ~~~~~
 COOLNESS = True
 
@@ -120,8 +122,10 @@ def replace_ids(ref_map_file,csv_mod_file,match_field='old_sample_name'):
     # write field_headers to new csv file
     write_out_csv(new_csv_file, csv_field_names)
 
-    # create dict from ref_map_file
+    # create dict from ref_map_file, matching all orig ids in one scan;
+    # a '-' in an orig id may be '-' or '_' in the csv
     ref_dict = build_id_ref_map(ref_map_file)
+    id_matcher = MultiMatcher(ref_dict, variants={'-': '-_'})
 
     for row in yield_csv_data(csv_mod_file):
         """search row[match_field] for match with key to orig id
@@ -129,12 +133,10 @@ def replace_ids(ref_map_file,csv_mod_file,match_field='old_sample_name'):
         """
         match_id = row[match_field]
 
-        for old_id,new_id in ref_dict.items():
-            old_patt = re.subn('-','[-_]',old_id)[0]
-            # log.info('--> old_patt %s, match_id %s', old_patt, match_id)
-            if re.search(old_patt,match_id):
-                # log.info('--> Match %s == %s', old_patt, match_id)
-                row[new_field_name] = re.subn(old_patt,new_id,match_id,count=1)[0]
+        (new_value, matched) = id_matcher.sub(match_id, count=1)
+        if matched:
+            # log.info('--> Match %s', match_id)
+            row[new_field_name] = new_value
 
         new_rows.append(row)
 
@@ -6,6 +6,7 @@ import importlib
 from pprint import pprint
 from cutlass import iHMPSession
 from cutlass_utils import format_query
+from cutlass_search import query_pages
 # from cutlass_search import retrieve_nodes, query_all_oql
 
 # Log It!
@@ -64,13 +65,14 @@ except Exception as e:
     raise e
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-def query_all_oql(session, namespace, node_type, query):
+def query_all_oql(session, namespace, node_type, query, workers=None):
     """use oql_query_all_pages for complete sets of results
+       (pages fetched `workers` at once; see cutlass_search.query_pages)
     [ Requires pre-existing 'iHMPSession'! ]
     """
-    cumulative = session.get_osdf().oql_query_all_pages(namespace, query)
-    results = cumulative['results']
     nodes = {r['id']:r
+             for results in query_pages(session, query, namespace,
+                                        workers, ordered=False)
              for r in results
              if r['node_type'] == node_type}
     count = len(nodes)
@@ -19,6 +19,8 @@ import sys
 import re
 
 from cutlass_utils import load_data, write_out_csv, get_field_header, log_it
+from join_utils import index_rows
+from lineage_utils import JaxidLineage
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Constants ~~~~~
 COOLNESS = True
@@ -31,13 +33,14 @@ class settings:
     node_id_tracking_file = path + 'prediabetes_node_id_tracking.csv'
 
     jaxid_ref_file = path + 'jaxid_database_export_20160801.csv'
-    id_ref_map = OrderedDict()
     mod_field_name = 'jaxid_parent_mismatch'
 
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Functional ~~~~~
 log = log_it('jaxid_parse_uploaded_mismatches')
 
+_node_rows = {}  # node_id_file: {node_type: [rows]}
+
 
 def import_whole_csv(filename):
     """loads data from concatenated sample sheet of all HMP2 samples """
@@ -47,121 +50,106 @@ def import_whole_csv(filename):
     return csv_data
 
 
-def build_id_ref_map(ref_in):
-    """construct reference mapping dict of ids from csv file"""
+def build_id_lineage(ref_in):
+    """construct jaxid lineage (received ancestor of each id) from csv file"""
     log.debug("begin function")
-    ref_map = {}
-    for row in load_data(ref_in):
-        ref_map[row['jaxid']] = row
+    lineage = JaxidLineage(load_data(ref_in))
     log.debug("finished function")
-    return ref_map
-
-
-def get_received_id(idrow):
-    """use get_parent_id to track recursively to original sample received"""
-    log.debug("going up the heritage")
-    # log.debug("idrow: %s", str(idrow))
-    try:
-        if idrow:
-            parent_id = idrow['parent_id']
-            if parent_id == 'received':
-                # log.debug("if1 parent_id: %s", parent_id)
-                return idrow['jaxid']
-            elif parent_id in settings.id_ref_map:
-                # log.debug("elif2 parent_id: %s", parent_id)
-                return get_received_id(settings.id_ref_map[parent_id])
-        else:
-            # log.debug("else parent_id: %s", parent_id)
-            return ''
-
-    except Exception, e:
-        log.exception(str(e))
-        raise e
+    return lineage
+
+
+def node_rows_by_type(node_id_file):
+    """rows of node_id_file by node_type, read once per run"""
+    if node_id_file not in _node_rows:
+        _node_rows[node_id_file] = index_rows(load_data(node_id_file),
+                                              'node_type')
+    return _node_rows[node_id_file]
 
 
 def gen_node_dict(node_id_file, node_type):
     """from incoming node file
        create dict generator of node_type with row's details
     """
-    for row in load_data(node_id_file):
-        if row['node_type'] == node_type:
-            yield row
+    for row in node_rows_by_type(node_id_file).get(node_type, []):
+        yield row
 
 
-def parse_jaxid_mismatches_samples(node_id_file,
-        new_file, new_fieldnames, mod_field_name, master_samples):
-    """read through rows of tracking file
-       append to mod_field_name to mark any mismatch errors found
-    """
-    node_type = 'sample'
-    log.info('checking master sample erroneous list')
-    for row in master_samples:
-        collab_sample = row['Random Final Sample Name']
-        tissue_sample = row['Specimen'].lower()
-        jaxid_sample = row['Recd JAXid']
+def index_master_samples(master_samples):
+    """master sample rows by (collab sample id, tissue type)"""
+    return index_rows(master_samples,
+                      lambda row: (row['Random Final Sample Name'],
+                                   row['Specimen'].lower()))
 
-        log.info('checking node id tracking list for SAMPLES')
-        for idrow in gen_node_dict(node_id_file, node_type):
-            int_id = idrow['internal_id']
-            # expected sample.internal_id format: collab-id_tissue_Jaxid
-            collab_id, tissue_id, jaxid = re.split('_', int_id)
 
-            if collab_sample == collab_id
-            and tissue_sample == tissue_id:
-            and jaxid_sample != jaxid:
-                idrow[mod_field_name] = ','.join(
-                    idrow[mod_field_name],
-                    'ERR:{},{}!={}?'.format(node_type,int_id,jaxid_sample))
-                log.debug('node err? %s', idrow[mod_field_name])
-                err_jaxid_samples.append(int_id)
-
-            write_out_csv(new_file, fieldnames=new_fieldnames, values=[idrow])
+def flag_mismatches(idrow, mod_field_name, node_type, received_id,
+                    master_rows):
+    """append to idrow[mod_field_name] an error for each of master_rows
+       whose received jaxid is not received_id; return idrow
+    """
+    errors = [idrow.get(mod_field_name)]
+    for row in master_rows:
+        jaxid_sample = row['Recd JAXid']
+        if jaxid_sample != received_id:
+            errors.append('ERR:{},{}!={}?'.format(
+                node_type, idrow['internal_id'], jaxid_sample))
+            log.debug('node err? %s', errors[-1])
+    idrow[mod_field_name] = ','.join(error for error in errors if error)
+    return idrow
 
 
-def parse_jaxid_mismatches_seqfiles(node_id_file,
-        new_file, new_fieldnames, mod_field_name, master_samples):
+def parse_jaxid_mismatches_samples(node_id_file,
+        new_file, new_fieldnames, mod_field_name, master_samples, lineage):
     """read through rows of tracking file
        append to mod_field_name to mark any mismatch errors found
     """
-    node_type = 'sixteensdnaprep'
-    log.info('checking master sample erroneous list')
-    for row in master_samples:
-        collab_sample = row['Random Final Sample Name']
-        tissue_sample = row['Specimen'].lower()
-        jaxid_sample = row['Recd JAXid']
-
-        log.info('checking node id tracking list for SAMPLES')
-        for idrow in gen_node_dict(node_id_file, node_type):
-            int_id = idrow['internal_id']
-            # expected dna prep id format:
-            #   HMP2_J16531_J16664_1_NS_T0_B0_0120_ZVGW5FI-03_AF11U
-            # need only elem[1:2] after _.split
-            collab_id, tissue_id, jaxid = re.split('_', int_id)
+    node_type = 'sample'
+    masters = index_master_samples(master_samples)
+    log.info('checking node id tracking list for SAMPLES')
+    rows = []
+    for idrow in gen_node_dict(node_id_file, node_type):
+        int_id = idrow['internal_id']
+        # expected sample.internal_id format: collab-id_tissue_Jaxid
+        collab_id, tissue_id, jaxid = re.split('_', int_id)
 
-            if collab_sample == collab_id
-            and tissue_sample == tissue_id:
-            and jaxid_sample != jaxid:
-                idrow[mod_field_name] = ','.join(
-                    idrow[mod_field_name],
-                    'ERR:{},{}!={}?'.format(node_type,int_id,jaxid_sample))
-                log.debug('node err? %s', idrow[mod_field_name])
+        flag_mismatches(idrow, mod_field_name, node_type,
+                        lineage.received_id(jaxid) or jaxid,
+                        masters.get((collab_id, tissue_id), []))
+        rows.append(idrow)
 
-            write_out_csv(new_file, fieldnames=new_fieldnames, values=[idrow])
+    write_out_csv(new_file, fieldnames=new_fieldnames, values=rows)
 
 
 def parse_jaxid_mismatches_seqfiles(node_id_file,
-        new_file, new_fieldnames, mod_field_name, master_samples):
+        new_file, new_fieldnames, mod_field_name, master_samples, lineage):
     """read through rows of tracking file
        append to mod_field_name to mark any mismatch errors found
     """
-
-
+    node_type = 'sixteensdnaprep'
+    masters = index_master_samples(master_samples)
+    log.info('checking node id tracking list for PREPS')
+    rows = []
+    for idrow in gen_node_dict(node_id_file, node_type):
+        int_id = idrow['internal_id']
+        # expected dna prep id format:
+        #   HMP2_J16531_J16664_1_NS_T0_B0_0120_ZVGW5FI-03_AF11U
+        # need only elem[1:2] after _.split: received, library jaxids
+        recd_jaxid, lib_jaxid = re.split('_', int_id)[1:3]
+        # parent sample.internal_id format: collab-id_tissue_Jaxid
+        collab_id, tissue_id, jaxid = re.split('_', idrow['parent_id'])
+
+        flag_mismatches(idrow, mod_field_name, node_type,
+                        lineage.received_id(lib_jaxid) or recd_jaxid,
+                        masters.get((collab_id, tissue_id), []))
+        rows.append(idrow)
+
+    write_out_csv(new_file, fieldnames=new_fieldnames, values=rows)
 
 
 def main():
     """make it happen'"""
 
     master_samples = import_whole_csv(settings.master_sample_file)
+    lineage = build_id_lineage(settings.jaxid_ref_file)
 
     log.info('loading node tracking file''s fieldnames')
     fieldnames_nodes = get_field_header(settings.node_id_tracking_file)
@@ -176,13 +164,15 @@ def main():
                                    new_node_file,
                                    fieldnames_nodes,
                                    settings.mod_field_name,
-                                   master_samples)
+                                   master_samples,
+                                   lineage)
 
     parse_jaxid_mismatches_seqfiles(settings.node_id_tracking_file,
                                     new_node_file,
                                     fieldnames_nodes,
                                     settings.mod_field_name,
-                                    master_samples)
+                                    master_samples,
+                                    lineage)
 
 
     log.info('The modified node tracking sheet is now: %s', new_node_file)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Keyed joins of csv rows, for the mapping and tracking sheet scripts
+   (dcc_submission_file_name_change.py, etc): rows of one sheet are indexed
+   by key once, then each row of the other is matched by dict lookup rather
+   than by scanning (or regex searching) the whole first sheet.
+"""
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Imports ~~~~~
+import re
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Constants ~~~~~
+TOKEN_SEP = re.compile('[^A-Za-z0-9]+')
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Functional ~~~~~
+
+def name_tokens(name):
+    """components of a file base name, e.g. 'HMP2_J09164_1_ST_..._ADM3N'
+       gives 'HMP2', 'J09164', '1', 'ST', ..., 'ADM3N'
+    """
+    return [token for token in TOKEN_SEP.split(name) if token]
+
+
+def index_rows(rows, key):
+    """dict of key value: list of rows having it (in order), for rows whose
+       key value is not empty.  key: a field name, or function of a row.
+    """
+    key_func = key if callable(key) else (lambda row: row[key])
+    index = {}
+    for row in rows:
+        value = key_func(row)
+        if value:
+            index.setdefault(value, []).append(row)
+    return index
+
+
+def join_rows(rows, index, key):
+    """yield (row, list of index rows with the same key) for each of rows,
+       streaming rows through; index as from index_rows(other_rows, ...).
+       key: a field name, or function of a row.
+    """
+    key_func = key if callable(key) else (lambda row: row[key])
+    for row in rows:
+        yield (row, index.get(key_func(row), []))
+
+
+class LibraryRunIndex(object):
+    """Prep rows indexed by library id, to find the preps whose library id
+       is a component of a file base name and whose run id occurs in it.
+       Library ids that are not a single name component are regex searched
+       for, as before.
+    """
+
+    def __init__(self, preps, library_field='jaxid_library',
+                 run_field='run_id'):
+        self.library_field = library_field
+        self.run_field = run_field
+        self.preps = []
+        self.by_library = {}  # library id: positions in preps
+        self.searched = []    # positions of multi-component library ids
+        for prep in preps:
+            libid = prep[library_field]
+            if not libid:
+                continue
+            if TOKEN_SEP.search(libid):
+                self.searched.append(len(self.preps))
+            else:
+                self.by_library.setdefault(libid, []).append(len(self.preps))
+            self.preps.append(prep)
+
+    def matches(self, file_base):
+        """preps matching file_base, in their original order"""
+        positions = set()
+        for token in name_tokens(file_base):
+            positions.update(self.by_library.get(token, ()))
+        positions.update(
+            pos for pos in self.searched
+            if re.search(self.preps[pos][self.library_field], file_base))
+        return [self.preps[pos] for pos in sorted(positions)
+                if re.search(self.preps[pos][self.run_field], file_base)]
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""JAX-ID lineage: each jaxid resolved up its chain of parent ids (as in the
+   jaxid database export: jaxid, parent_id, ...) to the received specimen it
+   was derived from.
+   Each chain is walked once; every jaxid on it is then remembered with its
+   received ancestor, so later lookups, and chains joining it, are immediate.
+   Used by jaxid_parse_uploaded_mismatches.py, etc.
+"""
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Imports ~~~~~
+import os
+import logging
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Constants ~~~~~
+RECEIVED = 'received'  # parent_id of the specimens as received
+
+log = logging.getLogger(os.path.basename(__file__))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Functional ~~~~~
+
+class JaxidLineage(object):
+    """Received ancestor of each jaxid of ref_rows (dicts of id_field and
+       parent_field, e.g. from load_data(jaxid_ref_file)).
+    """
+
+    def __init__(self, ref_rows, id_field='jaxid', parent_field='parent_id'):
+        self.parents = dict((row[id_field], row[parent_field])
+                            for row in ref_rows)
+        self.received = {}  # jaxid: received ancestor ('' if none found)
+
+    def __contains__(self, jaxid):
+        return jaxid in self.parents
+
+    def received_id(self, jaxid):
+        """jaxid of the received specimen jaxid derives from (itself if
+           received), or '' if its chain is broken before reaching one
+        """
+        path = []
+        found = ''
+        while jaxid not in self.received:
+            if jaxid not in self.parents:
+                break
+            if jaxid in path:
+                log.warning('Parent ids of %s loop back to it', jaxid)
+                break
+            path.append(jaxid)
+            parent_id = self.parents[jaxid]
+            if parent_id == RECEIVED:
+                found = jaxid
+                break
+            jaxid = parent_id
+        else:
+            found = self.received[jaxid]
+        # remember the whole chain walked, not only its start
+        for walked in path:
+            self.received[walked] = found
+        return found
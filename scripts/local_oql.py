@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""OQL (OSDF Query Language) queries run against a local snapshot of nodes,
+   e.g. the NodeRetrievalFiles csv's, or an osdf_mirror.OsdfMirror, rather
+   than on the OSDF server.
+
+   Queries are as made by cutlass_utils.format_query, e.g.
+       ("prediabetes"[tags] && "16s_raw_seq_set"[node_type])
+   with &&, ||, ! (or and, or, not), parentheses, and comparisons such as
+   [ver] > 1.  A "text"[field] term matches a node if each word of text is a
+   word of the field's value, ignoring case, as OSDF's text search does.
+   Fields are a node's id, node_type, ns or ver, else its meta field.
+
+   Words of each field queried are indexed once (tags, node_type and the
+   usual id fields on loading, others when first queried), so a query is a
+   few set operations, fast enough for use in loops.
+   LocalOql also stands in for an iHMPSession and its OSDF, for the OQL
+   calls in cutlass_search (query_all_oql, etc).
+"""
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Imports ~~~~~
+import os
+import re
+import csv
+import json
+import logging
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Constants ~~~~~
+# fields indexed when nodes are loaded
+INDEX_FIELDS = ('tags', 'node_type', 'rand_subject_id', 'visit_id', 'name',
+                'prep_id', 'comment')
+NODE_FIELDS = ('id', 'node_type', 'ns', 'ver')  # not meta fields
+JSON_FIELDS = ('linkage', 'meta', 'acl')  # json columns of retrieval csv's
+
+WORD = re.compile(r'\w+', re.UNICODE)
+TOKEN = re.compile(r'''\s*(?:
+        (?P<string>"(?:[^"\\]|\\.)*")
+      | \[(?P<field>[^\]]+)\]
+      | (?P<op>&&|\|\||==|!=|<=|>=|<|>|!|\(|\))
+      | (?P<word>[^\s"\[\]()&|!=<>]+)
+    )''', re.VERBOSE)
+KEYWORDS = {'and': '&&', 'or': '||', 'not': '!'}
+
+log = logging.getLogger(os.path.basename(__file__))
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Functional ~~~~~
+
+class OqlSyntaxError(ValueError):
+    pass
+
+
+def words(value):
+    """lowercased words of value, or of each item of a list value"""
+    if isinstance(value, (list, tuple)):
+        return set(word for item in value for word in words(item))
+    if value is None:
+        return set()
+    if not isinstance(value, type(u'')):
+        value = str(value)
+    return set(WORD.findall(value.lower()))
+
+
+def tokenize(query):
+    """list of (kind, text) tokens of OQL query"""
+    tokens = []
+    pos = 0
+    query = query.strip()
+    while pos < len(query):
+        match = TOKEN.match(query, pos)
+        if not match or match.end() == pos:
+            raise OqlSyntaxError('Unexpected {!r} in query: {}'.format(
+                query[pos:pos + 20], query))
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'string':
+            text = re.sub(r'\\(.)', r'\1', text[1:-1])
+        elif kind == 'word' and text.lower() in KEYWORDS:
+            kind, text = 'op', KEYWORDS[text.lower()]
+        tokens.append((kind, text))
+        pos = match.end()
+    return tokens
+
+
+def parse(query):
+    """parse OQL query into a tree of tuples:
+       ('or'|'and', left, right), ('not', term),
+       ('text', field, text), ('cmp', field, op, value)
+    """
+    tokens = tokenize(query)
+    pos = [0]
+
+    def peek():
+        return tokens[pos[0]] if pos[0] < len(tokens) else (None, None)
+
+    def take(kind=None, text=None):
+        token = peek()
+        if token[0] is None or (kind and token[0] != kind) or \
+                (text and token[1] != text):
+            raise OqlSyntaxError('Expected {} at token {} of query: {}'.format(
+                text or kind, pos[0] + 1, query))
+        pos[0] += 1
+        return token
+
+    def or_expr():
+        tree = and_expr()
+        while peek() == ('op', '||'):
+            take()
+            tree = ('or', tree, and_expr())
+        return tree
+
+    def and_expr():
+        tree = unary()
+        while peek() == ('op', '&&'):
+            take()
+            tree = ('and', tree, unary())
+        return tree
+
+    def unary():
+        if peek() == ('op', '!'):
+            take()
+            return ('not', unary())
+        return primary()
+
+    def primary():
+        kind, text = peek()
+        if (kind, text) == ('op', '('):
+            take()
+            tree = or_expr()
+            take('op', ')')
+            return tree
+        if kind in ('string', 'word'):
+            take()
+            return ('text', take('field')[1].strip(), text)
+        if kind == 'field':
+            take()
+            op = take('op')[1]
+            if op not in ('==', '!=', '<', '<=', '>', '>='):
+                raise OqlSyntaxError('Expected comparison after [{}] in '
+                                     'query: {}'.format(text, query))
+            value_kind, value = peek()
+            if value_kind not in ('string', 'word'):
+                raise OqlSyntaxError('Expected value after [{}] {} in '
+                                     'query: {}'.format(text, op, query))
+            take()
+            if value_kind == 'word':
+                value = number(value)
+            return ('cmp', text.strip(), op, value)
+        raise OqlSyntaxError('Unexpected {!r} in query: {}'.format(
+            text, query))
+
+    tree = or_expr()
+    if pos[0] != len(tokens):
+        raise OqlSyntaxError('Unexpected {!r} in query: {}'.format(
+            peek()[1], query))
+    return tree
+
+
+def number(text):
+    """text as an int or float if it is one, else text"""
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+
+def compare(value, op, other):
+    if value is None:
+        return op == '!='
+    if isinstance(other, (int, float)):
+        value = number(value) if not isinstance(value, (int, float)) \
+                else value
+        if not isinstance(value, (int, float)):
+            return op == '!='
+    elif not isinstance(value, (str, type(u''))):
+        value = str(value)
+    return {'==': value == other, '!=': value != other,
+            '<': value < other, '<=': value <= other,
+            '>': value > other, '>=': value >= other}[op]
+
+
+def retrieval_node(row):
+    """OSDF node dict from a node retrieval csv row (retrieve_query_all)"""
+    node = dict((f, row.get(f)) for f in NODE_FIELDS)
+    node['ver'] = number(node['ver']) if node['ver'] else node['ver']
+    for field in JSON_FIELDS:
+        node[field] = json.loads(row[field]) if row.get(field) else {}
+    return node
+
+
+class LocalOql(object):
+    """OQL queries over a list of OSDF node dicts (id, node_type, meta, ...)
+    """
+    is_local = True  # not a session of the OSDF server
+
+    def __init__(self, nodes, index_fields=INDEX_FIELDS):
+        self.nodes = {}
+        for node in nodes:
+            self.nodes[node['id']] = node
+        self.indexes = {}  # field: {word: set of node ids}
+        for field in index_fields:
+            self.index(field)
+        self.tree_cache = {}
+
+    @classmethod
+    def from_csv(cls, *csv_files, **kwargs):
+        """nodes of node retrieval csv_files, e.g. NodeRetrievalFiles;
+           of a node in several files, the last read is kept
+        """
+        nodes = []
+        for csv_file in csv_files:
+            log.info('Loading nodes from %s', csv_file)
+            with open(csv_file, 'rU') as csvfh:
+                nodes.extend(retrieval_node(row)
+                             for row in csv.DictReader(csvfh))
+        return cls(nodes, **kwargs)
+
+    @classmethod
+    def from_mirror(cls, mirror, node_type=None, **kwargs):
+        """nodes of an osdf_mirror.OsdfMirror (of node_type)"""
+        return cls(mirror.nodes(node_type), **kwargs)
+
+    def value(self, node, field):
+        if field in NODE_FIELDS:
+            return node.get(field)
+        return node.get('meta', {}).get(field)
+
+    def index(self, field):
+        """{word: set of node ids} of field, built on first use"""
+        if field not in self.indexes:
+            index = {}
+            for node_id, node in self.nodes.items():
+                for word in words(self.value(node, field)):
+                    index.setdefault(word, set()).add(node_id)
+            self.indexes[field] = index
+            log.debug('Indexed %s words of [%s]', len(index), field)
+        return self.indexes[field]
+
+    def _ids(self, tree):
+        kind = tree[0]
+        if kind == 'or':
+            return self._ids(tree[1]) | self._ids(tree[2])
+        if kind == 'and':
+            left = self._ids(tree[1])
+            return left & self._ids(tree[2]) if left else left
+        if kind == 'not':
+            return set(self.nodes) - self._ids(tree[1])
+        if kind == 'text':
+            index = self.index(tree[1])
+            found = None
+            for word in words(tree[2]):
+                ids = index.get(word, set())
+                found = ids if found is None else found & ids
+                if not found:
+                    return set()
+            return set(found) if found is not None else set()
+        if kind == 'cmp':
+            field, op, other = tree[1:]
+            return set(node_id for node_id, node in self.nodes.items()
+                       if compare(self.value(node, field), op, other))
+        raise OqlSyntaxError('Unknown query term {}'.format(kind))
+
+    def query(self, query):
+        """list of nodes matching OQL query, in node id order"""
+        if query not in self.tree_cache:
+            self.tree_cache[query] = parse(query)
+        return [self.nodes[node_id]
+                for node_id in sorted(self._ids(self.tree_cache[query]))]
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ iHMPSession / OSDF stand-ins ~~~~
+    def get_osdf(self):
+        return self
+
+    def oql_query(self, namespace, query, page=1):
+        """all results on page 1, as one page of an OSDF query"""
+        results = self.query(query) if page == 1 else []
+        return {'results': results, 'result_count': len(results),
+                'search_result_total': len(results) if page == 1 else 0}
+
+    def oql_query_all_pages(self, namespace, query):
+        results = self.query(query)
+        return {'results': results, 'result_count': len(results)}
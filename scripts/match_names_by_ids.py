@@ -2,11 +2,12 @@
 # -*- coding: utf-8 -*-
 
 import os
-import re
 import csv
 import logging
 import time
 
+from match_utils import MultiMatcher
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Functional ~~~~~
 # Log It!
 def log_it(logname=os.path.basename(__file__), logdir="logs"):
@@ -105,25 +106,49 @@ def write_out_csv(csv_file,fieldnames,values=[]):
         raise e
 
 
-def read_and_match(args):
-    """read index and tw odata file, then match data records by index rows"""
-    # indexes = [row for row in load_data(args.index_file)]
-    # for row in indexes:
+def names_by_id(names, matcher):
+    """dict of id: names containing it, scanning each name once for all ids;
+       a name counts for every id in it, also ids overlapping or within
+       another id found
+    """
+    by_id = {}
+    for name in names:
+        for id in matcher.find_all(name):
+            by_id.setdefault(id, []).append(name)
+    return by_id
 
+
+def read_and_match(args):
+    """read index and two data files, then match data records by index rows"""
     fields = ['orig_name','new_name']
     write_out_csv(args.outfile, fields)
 
-    orig = [row for row in load_data(args.data_file1)]
-    news = [row for row in load_data(args.data_file2)]
-
-    for row in load_data(args.index_file):
-        for old in orig:
-            if re.search(row['orig'], old['orig_name']):
-                for new in news:
-                    if re.search(row['new'], new['new_name']):
-                        vals = [{'orig_name': old['orig_name'],
-                                 'new_name': new['new_name']}]
-                        write_out_csv(args.outfile, fields, vals)
+    indexes = [row for row in load_data(args.index_file)]
+    # file names by the index ids each contains:
+    orig = names_by_id(
+        (row['orig_name'] for row in load_data(args.data_file1)),
+        MultiMatcher(dict((row['orig'], None) for row in indexes)))
+    news = names_by_id(
+        (row['new_name'] for row in load_data(args.data_file2)),
+        MultiMatcher(dict((row['new'], None) for row in indexes)))
+
+    unmatched = []
+    for row in indexes:
+        vals = [{'orig_name': old, 'new_name': new}
+                for old in orig.get(row['orig'], [])
+                for new in news.get(row['new'], [])]
+        if vals:
+            write_out_csv(args.outfile, fields, vals)
+        else:
+            unmatched.append(row)
+
+    log.info('Index entries matched: %s of %s',
+             len(indexes) - len(unmatched), len(indexes))
+    for row in unmatched:
+        log.warning('Unmatched index entry: orig %s (%s files), '
+                    'new %s (%s files)',
+                    row['orig'], len(orig.get(row['orig'], [])),
+                    row['new'], len(news.get(row['new'], [])))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Many ids matched at once: the ids of a mapping (e.g. old: new subject id,
+   from a mapping csv) are compiled into a single regex, shaped as a trie of
+   the ids, plus a lookup table from matched text back to its id.  Each text
+   is then scanned once for all ids, rather than once per id.
+   Used by hmp2_replace_subject_ids.py, grep_missing_jaxids.py, etc.
+"""
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Imports ~~~~~
+import io
+import re
+import logging
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Constants ~~~~~
+log = logging.getLogger('match_utils.py')
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Functional ~~~~~
+
+class MultiMatcher(object):
+    """Matches any of the ids (keys) of `mapping` in a text.
+       variants: {char: chars} lets a char of an id also match others,
+       e.g. {'-': '-_'} for ids whose dashes may be written as underscores.
+       Where ids overlap, the leftmost match wins, and of those the longest.
+    """
+    _cached = None
+    _cached_key = None
+
+    def __init__(self, mapping, variants=None, flags=0):
+        self.mapping = dict(mapping)
+        self.variants = variants or {}
+        # matched text, with variant chars made canonical: id
+        self._canonical = dict((alt, char)
+                               for char, alts in self.variants.items()
+                               for alt in alts)
+        self.ids = {}
+        for id in self.mapping:
+            canon = self.canonical(id)
+            if canon in self.ids and self.ids[canon] != id:
+                log.warning('Ids %s and %s match the same text; using %s',
+                            self.ids[canon], id, self.ids[canon])
+                continue
+            self.ids[canon] = id
+        self.regex = re.compile(self._trie_pattern(self.ids.values()), flags)
+        self._trie = None  # of canonical ids, built by find_all
+
+    @classmethod
+    def cached(cls, ids):
+        """matcher of ids, built once per process for the same ids"""
+        key = tuple(ids)
+        if cls._cached_key != key:
+            cls._cached = cls(dict((id, id) for id in ids))
+            cls._cached_key = key
+        return cls._cached
+
+    def canonical(self, text):
+        return ''.join(self._canonical.get(char, char) for char in text)
+
+    def _char_pattern(self, char):
+        if char in self.variants:
+            return '[' + ''.join(re.escape(alt)
+                                 for alt in self.variants[char]) + ']'
+        return re.escape(char)
+
+    def _trie_pattern(self, ids):
+        trie = {}
+        for id in ids:
+            if not id:
+                continue
+            node = trie
+            for char in id:
+                node = node.setdefault(char, {})
+            node[''] = True
+        return self._node_pattern(trie) or '(?!)'  # (?!): match nothing
+
+    def _node_pattern(self, node):
+        branches = [self._char_pattern(char) + self._node_pattern(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+        pattern = '(?:' + '|'.join(branches) + ')'
+        # an id ending here: try the longer ids first
+        return pattern + '?' if '' in node else pattern
+
+    def _id(self, match):
+        return self.ids[self.canonical(match.group(0))]
+
+    def search(self, text):
+        """(id, mapped value, match object) of first id in text, else None"""
+        match = self.regex.search(text)
+        if match:
+            id = self._id(match)
+            return (id, self.mapping[id], match)
+        return None
+
+    def find_all(self, text):
+        """set of ids found anywhere in text, as a search for each id would
+           find them: unlike finditer, also ids overlapping or within a
+           longer id found
+        """
+        if self._trie is None:
+            self._trie = {}
+            for canon, id in self.ids.items():
+                node = self._trie
+                for char in canon:
+                    node = node.setdefault(char, {})
+                node[''] = id
+        text = self.canonical(text)
+        found = set()
+        for start in range(len(text)):
+            node = self._trie
+            for char in text[start:]:
+                node = node.get(char)
+                if node is None:
+                    break
+                if '' in node:
+                    found.add(node[''])
+        return found
+
+    def finditer(self, text):
+        """yield (id, mapped value, match object) of each id found in text"""
+        for match in self.regex.finditer(text):
+            id = self._id(match)
+            yield (id, self.mapping[id], match)
+
+    def sub(self, text, count=0):
+        """text with ids replaced by their mapped values; (new text, count)"""
+        return self.regex.subn(lambda match: self.mapping[self._id(match)],
+                               text, count)
+
+
+def scan_file(filename, matcher):
+    """list of (id, line) for each id found in each line of filename,
+       in file order; lines without their line endings
+    """
+    hits = []
+    with io.open(filename, 'r', errors='replace') as fh:
+        for line in fh:
+            line = line.rstrip('\r\n')
+            for id in unique(found[0] for found in matcher.finditer(line)):
+                hits.append((id, line))
+    return hits
+
+
+def unique(items):
+    """items less repeats, in order"""
+    seen = set()
+    return [item for item in items if not (item in seen or seen.add(item))]
+
+
+def _pool_scan(job):
+    """scan_file for a pool worker: (filename, hits, error)"""
+    filename, ids = job
+    try:
+        return (filename, scan_file(filename, MultiMatcher.cached(ids)), None)
+    except Exception as e:
+        return (filename, None, '{}: {}'.format(type(e).__name__, e))
+
+
+def scan_files(ids, filenames, processes=None):
+    """lines of filenames containing each of ids, as an ordered dict of
+       id: list of (filename, line), each file read once for all ids
+       (rather than once per id, as `grep id file`).
+       Files are scanned `processes` at once (default: one per cpu).
+       Files that cannot be read are logged and skipped.
+    """
+    ids = unique(ids)
+    hits = OrderedDict((id, []) for id in ids)
+    filenames = list(filenames)
+    if not filenames:
+        return hits
+    jobs = [(filename, ids) for filename in filenames]
+    processes = min(processes or cpu_count(), len(filenames))
+    if processes <= 1:
+        results = (_pool_scan(job) for job in jobs)
+        pool = None
+    else:
+        log.info('Scanning %s files with %s processes',
+                 len(filenames), processes)
+        pool = Pool(processes)
+        results = pool.imap(_pool_scan, jobs)
+    try:
+        for filename, file_hits, error in results:
+            if error:
+                log.error('Scanning %s: %s', filename, error)
+                continue
+            log.debug('%s lines of ids in %s', len(file_hits), filename)
+            for id, line in file_hits:
+                hits[id].append((filename, line))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return hits
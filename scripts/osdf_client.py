@@ -0,0 +1,248 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Pooled OSDF client: keep-alive connections plus a bounded worker pool for
+issuing many OSDF requests at once.
+
+Stands in for the `osdf.OSDF` returned by `iHMPSession.get_osdf()` for the
+calls used in these scripts (get_node, edit_node, delete_node, oql_query,
+oql_query_all_pages), and adds `*_async` versions of each that return an
+AsyncResult; call `.get()` on it to wait for the outcome.
+oql_query_pages fetches the pages of a query concurrently.
+"""
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Imports ~~~~
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Core ~~ Imports ~~~~
+import os
+import json
+import base64
+import socket
+import threading
+from multiprocessing.pool import ThreadPool
+
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Third Party ~~ Imports ~~~~
+from cutlass_utils import log_it
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Constants ~~~~
+filename = os.path.basename(__file__)
+log = log_it(filename)
+
+DEFAULT_MAX_IN_FLIGHT = 16
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Internal Functions & Classes ~~~~
+
+class PooledOSDF(object):
+    """OSDF REST client keeping one keep-alive connection per worker thread,
+       with at most `max_in_flight` requests outstanding via the *_async calls.
+       Use as a context manager, or call close() when done.
+    """
+
+    def __init__(self, server, username, password, port=8123, ssl=True,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, timeout=300):
+        self.server = server
+        self.port = port
+        self.ssl = ssl
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        auth = '{}:{}'.format(username, password).encode('utf-8')
+        self._headers = {
+            'Authorization': 'Basic ' + base64.b64encode(auth).decode('ascii'),
+            'Content-Type': 'application/json',
+            'Connection': 'keep-alive',
+            }
+        self._local = threading.local()
+        self._pool = None
+        self._page_pool = None
+        self._pool_lock = threading.Lock()
+
+    @classmethod
+    def from_session(cls, session, **kwargs):
+        """build from an iHMPSession, using its OSDF connection settings"""
+        osdf = session.get_osdf()
+        def setting(name, default=None):
+            return getattr(osdf, name, getattr(session, name, default))
+        return cls(setting('server'), setting('username'),
+                   setting('password'), port=setting('port', 8123),
+                   ssl=setting('ssl', True), **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.max_in_flight)
+            return self._pool
+
+    @property
+    def page_pool(self):
+        """pool fetching the pages of oql_query_pages; apart from `pool`,
+           as oql_query_all_pages_async runs oql_query_pages on `pool`, and
+           would wait forever on page fetches queued behind itself
+        """
+        with self._pool_lock:
+            if self._page_pool is None:
+                self._page_pool = ThreadPool(self.max_in_flight)
+            return self._page_pool
+
+    def close(self):
+        """wait for outstanding requests, then shut down the worker pools"""
+        # requests on `pool` may still fetch pages, so it is joined first,
+        # and outside the lock the page_pool property takes
+        for name in ('_pool', '_page_pool'):
+            with self._pool_lock:
+                pool = getattr(self, name)
+            if pool is not None:
+                pool.close()
+                pool.join()
+                with self._pool_lock:
+                    setattr(self, name, None)
+        self._drop_connection()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Connections ~~~~
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn_class = httplib.HTTPSConnection if self.ssl \
+                         else httplib.HTTPConnection
+            conn = conn_class(self.server, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def request(self, method, path, body=None):
+        """send request on this thread's connection; return (status, data)
+           Retries once on a fresh connection if the server had closed it.
+        """
+        if body is not None and not isinstance(body, str):
+            body = json.dumps(body)
+        for attempt in (1, 2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body, self._headers)
+                response = conn.getresponse()
+                content = response.read()
+            except (httplib.HTTPException, socket.error) as e:
+                self._drop_connection()
+                if attempt == 2:
+                    raise
+                log.debug('Reconnecting after %s on %s %s', e, method, path)
+                continue
+            if response.getheader('connection', '').lower() == 'close':
+                self._drop_connection()
+            data = json.loads(content) if content.strip() else None
+            return (response.status, data)
+
+    def submit(self, func, *args, **kwargs):
+        """run func(*args, **kwargs) on the worker pool; return AsyncResult"""
+        return self.pool.apply_async(func, args, kwargs)
+
+    def map(self, func, iterable):
+        """func over iterable on the worker pool, results in input order"""
+        return self.pool.imap(func, iterable)
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ OSDF calls ~~~~
+    def get_node(self, node_id):
+        status, data = self.request('GET', '/nodes/{}'.format(node_id))
+        if status != 200:
+            raise Exception('Unable to retrieve node {}: HTTP {}'.format(
+                node_id, status))
+        return data
+
+    def edit_node(self, json_data):
+        node_id = json_data['id']
+        status, data = self.request('PUT', '/nodes/{}'.format(node_id),
+                                    json_data)
+        if status != 200:
+            raise Exception('Edit failed for node {}: HTTP {}, {}'.format(
+                node_id, status, data))
+        return data
+
+    def delete_node(self, node_id):
+        status, data = self.request('DELETE', '/nodes/{}'.format(node_id))
+        if status != 204 and status != 200:
+            raise Exception('Delete failed for node {}: HTTP {}'.format(
+                node_id, status))
+        return True
+
+    def oql_query(self, namespace, query, page=1):
+        status, data = self.request(
+            'POST', '/nodes/oql/{}/page/{}'.format(namespace, page), query)
+        if status != 200 and status != 206:
+            raise Exception('OQL query failed ({}): HTTP {}'.format(
+                query, status))
+        return data
+
+    def oql_query_pages(self, namespace, query, ordered=True):
+        """yield the results of each page of an OQL query.
+           The first page gives the total result count and page size; the
+           remaining pages are then fetched concurrently on the page pool,
+           and yielded in page order, or as they arrive if not `ordered`.
+           The total is search_result_total; result_count is only the
+           number of results on the page, so without a total the pages are
+           fetched one by one until one comes back empty.
+        """
+        first = self.oql_query(namespace, query, 1)
+        results = first.get('results', [])
+        if not results:
+            return
+        yield results
+        total = first.get('search_result_total')
+        if total is None:
+            page = 2
+            while True:
+                results = self.oql_query(namespace, query, page).get(
+                        'results', [])
+                if not results:
+                    return
+                yield results
+                page += 1
+        pages = range(2, (total + len(results) - 1) // len(results) + 1)
+        if pages:
+            log.debug('Fetching %s more pages of %s results', len(pages),
+                      total)
+            fetch = lambda page: self.oql_query(namespace, query, page)
+            fetch_map = self.page_pool.imap if ordered else \
+                        self.page_pool.imap_unordered
+            for data in fetch_map(fetch, pages):
+                yield data.get('results', [])
+
+    def oql_query_all_pages(self, namespace, query):
+        results = [r for page in self.oql_query_pages(namespace, query)
+                   for r in page]
+        return {'results': results, 'result_count': len(results)}
+
+    def get_node_async(self, node_id):
+        return self.submit(self.get_node, node_id)
+
+    def edit_node_async(self, json_data):
+        return self.submit(self.edit_node, json_data)
+
+    def delete_node_async(self, node_id):
+        return self.submit(self.delete_node, node_id)
+
+    def oql_query_async(self, namespace, query, page=1):
+        return self.submit(self.oql_query, namespace, query, page)
+
+    def oql_query_all_pages_async(self, namespace, query):
+        return self.submit(self.oql_query_all_pages, namespace, query)
+
+
+def get_pooled_osdf(session, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+    """return PooledOSDF sharing the connection settings of session"""
+    return PooledOSDF.from_session(session, max_in_flight=max_in_flight)
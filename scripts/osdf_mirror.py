@@ -0,0 +1,213 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Local mirror of OSDF nodes: each node of the study (all nodes tagged with
+settings.submission.study) kept in an SQLite db with its meta, linkage, ver
+and acl, indexed by node type and internal id.
+
+sync() stores only the nodes that are new or whose `ver` changed since the
+last sync, and, when syncing all study nodes, removes nodes no longer found.
+OQL cannot select nodes by version, so each sync still pages through the
+study's query results (see cutlass_search.query_pages for fetching pages
+concurrently), but unchanged nodes are not rewritten.
+Audits, retrievals and dry runs can then read nodes from the mirror, or
+export_csv() them as from retrieve_query_all, without querying OSDF.
+"""
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Imports ~~~~
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Core ~~ Imports ~~~~
+import os
+import sys
+import json
+import sqlite3
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Third Party ~~ Imports ~~~~
+import settings
+from cutlass_utils import log_it, format_query, get_cur_datetime
+from cutlass_search import RetrievalFields, query_pages, query_result_row, \
+                           write_retrieval_csv
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Constants ~~~~
+filename = os.path.basename(__file__)
+log = log_it(filename)
+
+JSON_FIELDS = ('linkage', 'meta', 'acl')
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Internal Functions & Classes ~~~~
+
+def study_query(study=None):
+    """OQL query of all nodes tagged with study"""
+    return format_query(study or settings.submission.study, field="tags")
+
+
+class OsdfMirror(object):
+    """OSDF nodes stored in an SQLite db, one row per node id, with the
+       columns of the node retrieval csv's (cutlass_search.RetrievalFields);
+       date_retrieved is when the node's current `ver` was stored.
+    """
+    table = 'nodes'
+
+    def __init__(self, db_file=None):
+        self.db_file = db_file or settings.mirror.path
+        db_dir = os.path.dirname(self.db_file)
+        if db_dir and not os.path.isdir(db_dir):
+            os.makedirs(db_dir)
+        self.conn = sqlite3.connect(self.db_file)
+        self.conn.text_factory = str
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS {} ({}, PRIMARY KEY (id))'.format(
+                    self.table,
+                    ', '.join(f + (' INTEGER' if f == 'ver' else ' TEXT')
+                              for f in RetrievalFields)))
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS {0}_node_idx '
+                'ON {0} (node_type, internal_id)'.format(self.table))
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS syncs ('
+                ' query TEXT, date_synced TEXT, new INTEGER,'
+                ' changed INTEGER, unchanged INTEGER, removed INTEGER)')
+
+    def close(self):
+        self.conn.close()
+
+    def versions(self):
+        """dict of node id: ver, of all mirrored nodes"""
+        return dict(self.conn.execute(
+            'SELECT id, ver FROM {}'.format(self.table)))
+
+    def sync(self, session, query=None, workers=None, prune=None):
+        """store the nodes of query (default: all study nodes) that are new
+           or changed since the last sync; with prune, remove mirrored
+           nodes the query no longer finds.  prune defaults to True only for
+           the default query, as a narrower one does not find every node.
+           Return dict of counts.
+        """
+        if prune is None:
+            prune = query is None
+        query = query or study_query()
+        log.info('Syncing mirror %s with "%s"', self.db_file, query)
+        known = self.versions()
+        seen = set()
+        counts = dict(new=0, changed=0, unchanged=0, removed=0)
+        insert = 'INSERT OR REPLACE INTO {} ({}) VALUES ({})'.format(
+            self.table, ', '.join(RetrievalFields),
+            ', '.join('?' * len(RetrievalFields)))
+
+        for results in query_pages(session, query, workers=workers,
+                                   ordered=False):
+            rows = []
+            for result in results:
+                seen.add(result['id'])
+                if result['id'] not in known:
+                    counts['new'] += 1
+                elif known[result['id']] != result['ver']:
+                    counts['changed'] += 1
+                else:
+                    counts['unchanged'] += 1
+                    continue
+                row = query_result_row(result)
+                rows.append(tuple(row[f] for f in RetrievalFields))
+            with self.conn:
+                self.conn.executemany(insert, rows)
+            log.debug('Stored %s of %s nodes', len(rows), len(results))
+
+        if prune:
+            gone = [(node_id,) for node_id in known if node_id not in seen]
+            with self.conn:
+                self.conn.executemany(
+                    'DELETE FROM {} WHERE id = ?'.format(self.table), gone)
+            counts['removed'] = len(gone)
+
+        with self.conn:
+            self.conn.execute(
+                'INSERT INTO syncs VALUES (?, ?, ?, ?, ?, ?)',
+                (query, get_cur_datetime(), counts['new'], counts['changed'],
+                 counts['unchanged'], counts['removed']))
+        log.info('Synced mirror: %s new, %s changed, %s unchanged, '
+                 '%s removed nodes', counts['new'], counts['changed'],
+                 counts['unchanged'], counts['removed'])
+        return counts
+
+    def _select(self, where='', args=()):
+        sql = 'SELECT {} FROM {}'.format(', '.join(RetrievalFields),
+                                         self.table)
+        if where:
+            sql += ' WHERE ' + where
+        return self.conn.execute(sql + ' ORDER BY node_type, internal_id',
+                                 args)
+
+    def rows(self, node_type=None):
+        """yield retrieval csv row dicts of mirrored nodes (of node_type)"""
+        cursor = self._select('node_type = ?', (node_type,)) if node_type \
+                 else self._select()
+        for row in cursor:
+            yield dict(zip(RetrievalFields, row))
+
+    def nodes(self, node_type=None):
+        """yield mirrored nodes (of node_type), as OSDF node dicts"""
+        for row in self.rows(node_type):
+            yield self._node(row)
+
+    def _node(self, row):
+        node = dict((f, row[f]) for f in ('id', 'node_type', 'ns', 'ver'))
+        for field in JSON_FIELDS:
+            node[field] = json.loads(row[field])
+        return node
+
+    def get_node(self, node_id):
+        """mirrored node of node_id, else None"""
+        row = self._select('id = ?', (node_id,)).fetchone()
+        return self._node(dict(zip(RetrievalFields, row))) if row else None
+
+    def find(self, node_type, internal_id):
+        """list of mirrored nodes of node_type with internal_id"""
+        return [self._node(dict(zip(RetrievalFields, row)))
+                for row in self._select('node_type = ? AND internal_id = ?',
+                                        (node_type, internal_id))]
+
+    def count(self, node_type=None):
+        sql = 'SELECT count(*) FROM {}'.format(self.table)
+        if node_type:
+            return self.conn.execute(sql + ' WHERE node_type = ?',
+                                     (node_type,)).fetchone()[0]
+        return self.conn.execute(sql).fetchone()[0]
+
+    def export_csv(self, data_file, node_type=None):
+        """write mirrored nodes (of node_type) to data_file, as a node
+           retrieval csv; return count
+        """
+        log.info('Exporting mirrored %s nodes to %s',
+                 node_type or 'all', data_file)
+
+        def row_pages(size=1000):
+            rows = []
+            for row in self.rows(node_type):
+                rows.append(row)
+                if len(rows) >= size:
+                    yield rows
+                    rows = []
+            if rows:
+                yield rows
+
+        return write_retrieval_csv(data_file, row_pages())
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Main Actions ~~~~~
+def main():
+    """sync the local mirror of all study nodes from OSDF"""
+    from cutlass import iHMPSession
+    from settings import auth
+
+    session = iHMPSession(auth.dcc_user, auth.dcc_pass, ssl=False)
+    log.info('Loaded session: {}'.format(session.get_session()))
+    mirror = OsdfMirror()
+    try:
+        mirror.sync(session)
+    finally:
+        mirror.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,6 +8,7 @@ from settings import auth
 from settings import NodeRetrievalFiles
 from cutlass_utils import log_it, format_query
 from cutlass_search import retrieve_nodes, retrieve_query_all
+from osdf_mirror import OsdfMirror
 
 log = log_it('retrieve_osdf_nodes')
 log.info('Starting metadata download from OSDF server.')
@@ -17,8 +18,14 @@ session = iHMPSession(auth.dcc_user, auth.dcc_pass, ssl=False)
 log.info('Loaded session: {}'.format(session.get_session()))
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Main Actions ~~~~~
-def retrieve_node_type(session, node_type):
+def retrieve_node_type(session, node_type, mirror=None):
+    """write node_type's nodes to its NodeRetrievalFiles csv, from OSDF,
+       or from a synced OsdfMirror if given
+    """
     data_file_name = NodeRetrievalFiles[node_type]
+    if mirror:
+        mirror.export_csv(data_file_name, node_type)
+        return
     qry = '&&'.join([format_query("prediabetes", field="tags"),
                      format_query(node_type, field="node_type")])
     log.debug("query: %s", qry)
@@ -28,6 +35,11 @@ def retrieve_node_type(session, node_type):
 def main():
     """make it happen!"""
 
+    """ Sync the local mirror, then export from it instead: """
+    mirror = None
+    # mirror = OsdfMirror()
+    # mirror.sync(session)
+
     """ Subject node """
     # retrieve_node_type(session, 'subject')
     """ Visit node """
@@ -37,8 +49,8 @@ def main():
 
     """ 16S nodes """
     # retrieve_node_type(session, '16s_dna_prep')
-    retrieve_node_type(session, '16s_raw_seq_set')
-    retrieve_node_type(session, '16s_trimmed_seq_set')
+    retrieve_node_type(session, '16s_raw_seq_set', mirror)
+    retrieve_node_type(session, '16s_trimmed_seq_set', mirror)
 
     """ WGS nodes """
     # retrieve_node_type(session, 'wgs_dna_prep')
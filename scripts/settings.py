@@ -34,6 +34,48 @@ class node_id_tracking:
     id_fields = ['node_type', 'internal_id', 'osdf_node_id',
                  'parent_node_type', 'parent_id', 'parent_node_id',
                  'date_submitted']
+    # 'csv' reads/appends `path`; 'sqlite' uses `path` with a '.db' extension
+    # (imported from `path` on first use, and new rows still appended to
+    # `path`; see cutlass_utils.get_tracking_index)
+    backend = 'csv'
+
+class submission:
+    # records saved concurrently by each nodes/*.submit(); 1 == serially
+    workers = 1
+    # True: load all nodes of a type once, then resolve each record's
+    # existing node from memory (see cutlass_utils.prefetch_nodes)
+    prefetch = False
+    # tag of the study's nodes (see osdf_mirror)
+    study = 'prediabetes'
+    # True: look up the existing nodes of all of a data file's records with
+    # a few OQL queries before submitting them (see cutlass_utils.load_nodes)
+    lookup_ahead = False
+    # True: keep every node returned by load_node searches for the run, so
+    # later records with the same or a sibling's id need no search
+    search_cache = False
+    # True: skip records already saved by an earlier run of the same data
+    # file, as recorded in '<data file>.checkpoint' (delete it to start over)
+    resume = False
+
+class query:
+    # OQL result pages fetched at once (after the first, which gives the
+    # result count; see cutlass_search.query_pages); 1 == one by one
+    page_workers = 1
+    # most search terms OR-combined in one OQL lookup of many ids
+    # (see cutlass_utils.load_nodes)
+    lookup_clauses = 1000
+
+class mirror:
+    # local SQLite mirror of all study nodes (see osdf_mirror.OsdfMirror);
+    # run osdf_mirror.py to sync it from OSDF
+    path = './osdf_node_records/prediabetes_nodes_mirror.db'
+
+class csv_output:
+    # True: write_out_csv keeps each output file open for the run, writing
+    # rows out every `batch_rows` rows or `flush_seconds` (see CsvFileWriter)
+    buffered = False
+    batch_rows = 100
+    flush_seconds = 5
 
 # data file names
 NodeDataFiles = {
@@ -17,6 +17,7 @@ import sys
 import re
 
 from cutlass_utils import load_data, write_out_csv, get_field_header, log_it
+from join_utils import index_rows, join_rows
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Constants ~~~~~
 COOLNESS = True
@@ -51,8 +52,17 @@ def add_jaxid_to_master_list(jaxids, samples, new_master_file, fieldnames):
        Output: write new_master_file
     """
     log.info('in add_jaxid_to_master_list function')
+    # received jaxids, by lowercased collab id and body site:
+    jaxid_index = index_rows(
+        (idrow for idrow in load_data(jaxids)
+         if idrow['parent_id'] == 'received'),
+        lambda idrow: (idrow['collab_id'].lower(),
+                       trans_sample_type(idrow['sample'])))
+    sample_key = lambda row: (row['Random Final Sample Name'].lower(),
+                              row['Specimen'].lower())
+
     matched = 0
-    for row in load_data(samples):
+    for row, idrows in join_rows(load_data(samples), jaxid_index, sample_key):
         sample_old = row['Original Sample Name']
         # sample_final = row['Final Sample Name']
         sample_rand = row['Random Final Sample Name']
@@ -65,41 +75,31 @@ def add_jaxid_to_master_list(jaxids, samples, new_master_file, fieldnames):
 
         log.info('processing row: %s, %s', sample_rand, dna_vs_rna)
         body_site = row['Specimen'].lower()
-        # check jaxid_db for match
-        for idrow in load_data(jaxids):
-            # collab_id = idrow['collab_id'][0:len(sample_id)+1]
-            collab_id = idrow['collab_id']
+        # jaxid_db rows matching on collab id and body site
+        for idrow in idrows:
             nucleic_acid = idrow['nucleic_acid']
-            if idrow['parent_id'] == 'received':
-                if body_site == trans_sample_type(idrow['sample']):
-                    sample = sample_rand.lower()
-                    collab = collab_id.lower()
-                    # if re.search(sample, collab):
-                    if sample == collab:
-                        if idrow['id_type'] == material_recd == 'specimen':
-                            if (body_site == "nasal" and\
-                                re.match(dna_vs_rna, idrow['notes']))\
-                               or body_site == "stool":
-                                row['Tissue JAX-ID'] += ' ' + idrow['jaxid']
-                                matched += 1
-                                log.debug('Matched: tissue %s == %s',
-                                          row['Tissue JAX-ID'], idrow['jaxid'])
-
-                        elif idrow['id_type'] == 'extraction':
-                            if nucleic_acid == material_recd == 'gDNA':
-                                row['gDNA JAX-ID'] += ' ' + idrow['jaxid']
-                                matched += 1
-                                log.debug('Matched: gDNA %s == %s',
-                                          row['gDNA JAX-ID'], idrow['jaxid'])
-                            if nucleic_acid == material_recd and \
-                                material_recd in \
-                                ['cDNA', 'Rib Depleted RNA', 'Total RNA']:
-                                row['RNA JAX-ID'] += ' ' + idrow['jaxid']
-                                matched += 1
-                                log.debug('Matched: RNA %s == %s',
-                                          row['RNA JAX-ID'], idrow['jaxid'])
-                    # else:
-                        # log.debug('No match on id: %s', collab)
+            if idrow['id_type'] == material_recd == 'specimen':
+                if (body_site == "nasal" and\
+                    re.match(dna_vs_rna, idrow['notes']))\
+                   or body_site == "stool":
+                    row['Tissue JAX-ID'] += ' ' + idrow['jaxid']
+                    matched += 1
+                    log.debug('Matched: tissue %s == %s',
+                              row['Tissue JAX-ID'], idrow['jaxid'])
+
+            elif idrow['id_type'] == 'extraction':
+                if nucleic_acid == material_recd == 'gDNA':
+                    row['gDNA JAX-ID'] += ' ' + idrow['jaxid']
+                    matched += 1
+                    log.debug('Matched: gDNA %s == %s',
+                              row['gDNA JAX-ID'], idrow['jaxid'])
+                if nucleic_acid == material_recd and \
+                    material_recd in \
+                    ['cDNA', 'Rib Depleted RNA', 'Total RNA']:
+                    row['RNA JAX-ID'] += ' ' + idrow['jaxid']
+                    matched += 1
+                    log.debug('Matched: RNA %s == %s',
+                              row['RNA JAX-ID'], idrow['jaxid'])
 
         write_out_csv(new_master_file,
                       fieldnames=fieldnames,
@@ -114,23 +114,24 @@ def add_visit_id_to_master_list(visit_ids, master_sample_file,
        using visit name, number and interval
     """
     log.info('mod\'ing master list pre-coalescing, adding visit_id fields')
+    visit_index = index_rows(load_data(visit_ids), 'Visit ID')
 
-    for row in load_data(master_sample_file):
-        sample_final = row['Final Sample Name']
+    for row, vrows in join_rows(load_data(master_sample_file), visit_index,
+                                'Final Sample Name'):
         # reset to blank all fields being added
         row['visit_number'] = ''
         row['interval'] = ''
         row['study_date'] = ''
 
-        for vrow in load_data(visit_ids):
+        # last of the visits matching on id
+        for vrow in vrows:
             visit_id = vrow['Visit ID']
-            if sample_final == visit_id:
-                row['visit_number'] = vrow['visit_num']
-                row['interval'] = vrow['interval']
-                row['study_date'] = vrow['Study Day']
-                row['visit_id'] = '_'.join([visit_id,
-                                            vrow['visit_num'],
-                                            vrow['interval']])
+            row['visit_number'] = vrow['visit_num']
+            row['interval'] = vrow['interval']
+            row['study_date'] = vrow['Study Day']
+            row['visit_id'] = '_'.join([visit_id,
+                                        vrow['visit_num'],
+                                        vrow['interval']])
 
         write_out_csv(new_master_file,
                       fieldnames=new_master_fieldnames,
@@ -17,6 +17,8 @@ import csv
 import logging
 import time
 
+from archive_utils import prefix_tar, run_pooled
+
 """Subprocess module wrappers"""
 from subprocess import call, check_output
 from subprocess import STDOUT
@@ -28,6 +30,7 @@ COOLNESS = True
 class settings:
     data_path = '/data/weinstocklab/projects/HMP2/submissions/data/'
     renamed_path = 'renamed/16S'
+    archive_workers = None # archives built at once; None: per cpu
 
 settings.mapping_file = os.path.join(settings.data_path, settings.renamed_path, '20170105_raw_name_updates_351.csv')
 # settings.mapping_file = os.path.join(settings.data_path, settings.renamed_path, '20170105_clean_name_updates_351.csv')
@@ -150,14 +153,11 @@ def get_output(cmd_string, stderr=STDOUT, shell=True,
                         universal_newlines=universal_newlines, **kwargs)
 
 def generate_raw_tar(dest_path="./", file_prefix=""):
-    """generate tar archives, return file name"""
+    """generate tar archive of files named file_prefix*, return file name"""
     try:
-        src_path = os.path.dirname(file_prefix)
-        prefix = os.path.basename(file_prefix)
-        os.chdir(src_path)
-        tar_file = os.path.join(dest_path, file_prefix + '.raw.fastq.tar')
-        tar_cmd = ' '.join(['tar', 'chf', tar_file, prefix+'*'])
-        tar_stat = get_output(tar_cmd)
+        tar_file = os.path.join(dest_path,
+                                os.path.basename(file_prefix) + '.raw.fastq.tar')
+        prefix_tar(tar_file, file_prefix)
 
         log.info('Archive file created: %s', tar_file)
         return tar_file
@@ -177,24 +177,34 @@ def archive_raw_fastq_files(settings):
     archived = 0
     errored = 0
     errfiles = []
+    archives = [] # (file_path, prefix, dest) of each archive to build
     for row in yield_csv_data(map_file):
         if (re.search('raw', row['dir']) and
                 row['dcc_file_base'] != ''):
             dest = row['dcc_file_base']
             dir = row['dir']
-            try:
-                file_path = os.path.join(data_path, renamed_path, dir)
-                # log.debug('(%s)... file_path: %s', 'archive', file_path)
-                pref = os.path.join(file_path, dest)
-                tar_file = generate_raw_tar(file_path, file_prefix=pref)
-                # archived += 1 #debug "+= 1" syntax errors
-
-            except Exception, e:
-                log.error('Error in "%s"!!!   %s', 'archive_raw_fastq_files', e)
-                errfiles.append(dest)
+            file_path = os.path.join(data_path, renamed_path, dir)
+            # log.debug('(%s)... file_path: %s', 'archive', file_path)
+            pref = os.path.join(file_path, dest)
+            archives.append((file_path, pref, dest))
+
+    # build archives at once, on `settings.archive_workers` threads:
+    def archive(job):
+        (file_path, pref, dest) = job
+        return generate_raw_tar(file_path, file_prefix=pref)
+
+    workers = getattr(settings, 'archive_workers', None)
+    for (file_path, pref, dest), tar_file, e in run_pooled(archive, archives,
+                                                           workers):
+        if e:
+            log.error('Error in "%s"!!!   %s', 'archive_raw_fastq_files', e)
+            errored += 1
+            errfiles.append(dest)
+        else:
+            archived += 1
     # summarize:
-    # if errored:
-    if True:
+    log.info('-> Files successfully archived: %4s', str(archived))
+    if errored:
         log.error('-> For specifics on these files that errored, please see the logfile.')
         log.error('-> Files: %s', str(errfiles))
 
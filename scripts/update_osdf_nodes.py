@@ -5,9 +5,10 @@ import sys
 from cutlass import iHMPSession
 
 from settings import auth
-from settings import NodeUpdateFiles
+from settings import NodeUpdateFiles, NodeRetrievalFiles
 from cutlass_utils import log_it
-from cutlass_search import update_nodes, delete_nodes, update_nodes_general
+from cutlass_search import update_nodes, delete_nodes, update_nodes_general, \
+                           UpdatePlan, load_retrieved_nodes
 
 log = log_it('jax_osdf_update')
 log.info('Starting metadata submission to OSDF server.')
@@ -26,6 +27,11 @@ def main():
     # study_name = 'prediabetes'
     # study_node_id = '194149ed5273e3f94fc60a9ba58f7c24'
 
+    """ Skip unchanged nodes; compare to today's retrievals, if made: """
+    plan = UpdatePlan()
+    # plan = UpdatePlan(load_retrieved_nodes(*NodeRetrievalFiles.values()))
+    # plan = UpdatePlan(dry_run=True)  # only log, count what would change
+
     """ Subject node """
     # update_nodes(session, NodeUpdateFiles['Subject'], 'subject')
     """ Visit node """
@@ -52,7 +58,7 @@ def main():
     """ Arbitrary """
     # update_nodes(session, 'osdf_node_records/20170309_update_r16sPreps_4.csv', 'multiple')
     # update_nodes(session, 'osdf_node_records/20170309_update_r16sPreps_4.csv', 'multiple')
-    update_nodes_general(session, NodeUpdateFiles['general'])
+    update_nodes_general(session, NodeUpdateFiles['general'], plan=plan)
 
     """ Deletions """
     from osdf_delete_ids import node_ids